@@ -1,21 +1,85 @@
-from pySPM import Bruker
-import pandas as pd
-import tkinter as tk
-from tkinter import ttk, filedialog as fd, messagebox as mb
+from spm_header import PREFETCH_DEPTH, PREFETCH_THREADS, load_scan, prefetch_headers, read_header_bytes
+from metadata_cache import HeaderCache
+from value_parser import decode_value, parse_number
+from result_table import ResultTable, with_unit_headers
+from discovery import discover, check_magic_bytes, sniff, sniff_bytes
+from manifest import ExportManifest
+from drift import drift_tables
+from file_errors import FileError, rejection_errors
+from metadata_index import MetadataIndex
+from schema import SchemaCache, SchemaIndex, folder_signatures, parse_header_column
+from instrumentation import RunStats, profiled
+from exporters import FORMATS, LAYOUTS, DEFAULT_LAYOUTS, StreamingExporter, export_tables, format_from_path
+import importlib
 import os
 import sys
 from os.path import dirname, join,abspath
 import logging
 import subprocess
+from collections import deque, namedtuple
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import multiprocessing
+import sqlite3
+import threading
+import time
 
 # Setup logging
-log_dir = os.path.join(os.getenv('LOCALAPPDATA'), 'Meta_Data_Reader')
+# LOCALAPPDATA only exists on Windows, elsewhere use the XDG data directory
+log_dir = os.path.join(os.getenv('LOCALAPPDATA') or os.getenv('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'Meta_Data_Reader')
 os.makedirs(log_dir, exist_ok=True)  # Create directory if it doesn't exist
 log_file = os.path.join(log_dir, 'script.log')
 logging.basicConfig(level=logging.DEBUG, filename=log_file, filemode='a')
 logging.debug("Script started")
+# Per-value and per-file messages of the extraction hot path, off unless debugging;
+# the environment variable also reaches the worker processes
+values_log = logging.getLogger('MetaDataReader.values')
+values_log.setLevel(logging.DEBUG if os.getenv('META_DATA_READER_DEBUG') else logging.INFO)
 
-def create_gui(root, columns):
+# Parsed headers are cached next to the log, keyed by path, size and mtime
+CACHE_FILE = os.path.join(log_dir, 'metadata_cache.sqlite')
+# Header keys found per folder (see discover_schema)
+SCHEMA_FILE = os.path.join(log_dir, 'schema_cache.sqlite')
+# Searchable metadata of every file indexed so far (see index_metadata)
+INDEX_FILE = os.path.join(log_dir, 'metadata_index.sqlite')
+# Columns scans are usually looked up by get a database index
+INDEXED_COLUMNS = ['Probe', 'Channel Name', 'Scan Rate', 'Setpoint', 'Sample Bias', 'Scan x size', 'Up / Down']
+
+# Batches at least this large are written row by row while they are read
+STREAM_THRESHOLD = 5000
+
+# Heavy modules stay out of the startup path; the GUI imports them in the background
+# while the column picker is open, so neither the window nor the first export waits
+PRELOAD_MODULES = ('numpy', 'pandas', 'xlsxwriter')
+
+# Number of worker processes used for extraction; 1 with the file budget off runs everything in-process
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Header bytes of the next ``depth`` files are read by ``threads`` I/O threads while
+# earlier files are parsed; Prefetch(0, 0) reads every file in the parser instead
+Prefetch = namedtuple('Prefetch', ['depth', 'threads'])
+DEFAULT_PREFETCH = Prefetch(PREFETCH_DEPTH, PREFETCH_THREADS)
+
+# Limits per file in the worker processes: a file without a result after ``seconds``
+# has its worker killed, and a worker may allocate at most ``memory`` bytes beyond its
+# start-up size (Linux only); None switches a limit off
+FileBudget = namedtuple('FileBudget', ['seconds', 'memory'])
+DEFAULT_BUDGET = FileBudget(60, 1024 * 1024 * 1024)
+
+def preload_modules(names=PRELOAD_MODULES):
+    start = time.perf_counter()
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logging.debug(f"Preloading {name} failed: {str(e)}")
+    logging.debug(f"Preloaded {', '.join(names)} in {time.perf_counter() - start:.2f} s")
+
+def create_gui(root, columns, export_vars=None):
+    import tkinter as tk
+    from tkinter import ttk
     logging.debug("Entering create_gui")
     interesting_columns = [
         'Filename', 'Up / Down', 'Setpoint', 'Sample Bias', 'Lines (real)', 
@@ -99,6 +163,7 @@ def create_gui(root, columns):
         })
     style.theme_use("modern")
     style.configure("TButton", bordercolor='#00b7eb', lightcolor='#00e6ff', darkcolor='#008bb5', anchor='center')
+    style.configure("TLabel", background='#ffffff', font=('Helvetica', 10))
     
     frame = ttk.Frame(root, padding=20)
     frame.pack(fill='both', expand=True)
@@ -153,11 +218,41 @@ def create_gui(root, columns):
         cb = ttk.Checkbutton(frame, text=col, variable=vars_dict[col])
         cb.grid(row=row, column=col_idx, sticky=tk.W, padx=10, pady=3)
     
+    # Any other header key, picked from the keys found in a folder
+    header_columns = []
+    header_frame = ttk.Frame(frame)
+    header_frame.grid(row=7, column=0, columnspan=8, sticky=tk.W, padx=10, pady=(10, 0))
+    header_label = ttk.Label(header_frame, text="")
+    def add_header_keys():
+        from tkinter import filedialog as fd, messagebox as mb
+        folder = fd.askdirectory(parent=root, title="Choose a Folder to Read the Header Keys From")
+        if not folder:
+            return
+        def read_keys(progress, cancel):
+            def report(done, total=None):
+                progress(done, total, None if total is None else f"Reading the headers of {total} files...")
+            return discover_schema([folder], recursive=True, progress=report, cancel=cancel)
+        try:
+            schema = run_with_progress(root, None, read_keys, title="Reading Header Keys", dialog=True)
+        except Exception as e:
+            logging.debug(f"Schema discovery failed: {str(e)}")
+            mb.showerror("Reading Header Keys Failed", str(e))
+            return
+        finally:
+            root.title("Select Metadata Columns")
+        if not schema.keys:
+            mb.showwarning("No Header Keys", f"No readable .spm or numeric files found in {folder}.")
+            return
+        header_columns[:] = choose_header_keys(root, schema, header_columns)
+        header_label['text'] = f"{len(header_columns)} header keys added" if header_columns else ""
+    ttk.Button(header_frame, text="More header keys...", command=add_header_keys).pack(side=tk.LEFT)
+    header_label.pack(side=tk.LEFT, padx=10)
+    
     selected_columns = []
     submit_var = tk.BooleanVar()
     def submit():
         nonlocal selected_columns
-        selected_columns[:] = [col for col, var in vars_dict.items() if var.get()]
+        selected_columns[:] = [col for col, var in vars_dict.items() if var.get()] + header_columns
         logging.debug(f"Columns selected in submit: {selected_columns}")
         frame.destroy()
         submit_var.set(True)
@@ -170,104 +265,224 @@ def create_gui(root, columns):
         submit_var.set(True)
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
-    ttk.Button(frame, text="Submit", command=submit).grid(row=6, column=0, columnspan=8, pady=15)
+    if export_vars is not None:
+        format_var, layout_var, folder_var, channels_var, drift_var = export_vars
+        options = ttk.Frame(frame)
+        options.grid(row=6, column=0, columnspan=8, sticky=tk.W, padx=10, pady=(10, 0))
+        ttk.Label(options, text="Output format:").pack(side=tk.LEFT)
+        ttk.Combobox(options, textvariable=format_var, values=list(FORMATS.values()), state='readonly', width=26).pack(side=tk.LEFT, padx=(5, 20))
+        ttk.Label(options, text="Layout:").pack(side=tk.LEFT)
+        ttk.Combobox(options, textvariable=layout_var, values=list(LAYOUTS.values()), state='readonly', width=34).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options, text="Read a whole folder (with subfolders)", variable=folder_var).pack(side=tk.LEFT, padx=(20, 0))
+        # Empty means all channels, e.g. "1" or "Height, interleave" picks only those
+        ttk.Label(options, text="Channels:").pack(side=tk.LEFT, padx=(20, 0))
+        ttk.Entry(options, textvariable=channels_var, width=20).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(options, text="Add a drift report", variable=drift_var).pack(side=tk.LEFT, padx=(20, 0))
+        
+        def update_layout(*args):
+            fmt = {label: key for key, label in FORMATS.items()}[format_var.get()]
+            layout_var.set(LAYOUTS[DEFAULT_LAYOUTS[fmt]])
+        trace_id = format_var.trace_add('write', update_layout)
+        frame.bind('<Destroy>', lambda event: event.widget is frame and format_var.trace_remove('write', trace_id))
+    
+    ttk.Button(frame, text="Submit", command=submit).grid(row=8, column=0, columnspan=8, pady=15)
     logging.debug("Waiting for GUI interaction")
     root.wait_variable(submit_var)
     logging.debug(f"Returning selected columns: {selected_columns}")
     return selected_columns
 
-def retrieve_data(ScanB, Columns, spm_scanner_keys, spm_layers_keys, max_channels):
+def choose_header_keys(root, schema, selected=()):
+    """Let the user pick header keys of ``schema`` in a dialog; return their column names."""
+    import tkinter as tk
+    from tkinter import ttk
+    entries = schema.entries()
+    dialog = tk.Toplevel(root)
+    dialog.title("Header Keys")
+    dialog.configure(bg='#ffffff')
+    dialog.transient(root)
+    frame = ttk.Frame(dialog, padding=20)
+    frame.pack(fill='both', expand=True)
+    ttk.Label(frame, text=f"Keys found in {len(schema.files)} files, select the ones to add as columns:").pack(anchor=tk.W, pady=(0, 10))
+    
+    box = ttk.Frame(frame)
+    box.pack(fill='both', expand=True)
+    listbox = tk.Listbox(box, selectmode=tk.MULTIPLE, width=100, height=25, font=('Courier', 9), activestyle='none')
+    scrollbar = ttk.Scrollbar(box, orient=tk.VERTICAL, command=listbox.yview)
+    listbox.configure(yscrollcommand=scrollbar.set)
+    listbox.pack(side=tk.LEFT, fill='both', expand=True)
+    scrollbar.pack(side=tk.LEFT, fill='y')
+    for i, entry in enumerate(entries):
+        kind = (f"number [{entry.unit}]" if entry.unit else "number") if entry.numeric else "text"
+        listbox.insert(tk.END, f"{entry.column:<40.40} {entry.files:>6} files  {kind:<16.16} {entry.example}")
+        if entry.column in selected:
+            listbox.selection_set(i)
+    
+    chosen = list(selected)
+    def ok():
+        chosen[:] = [entries[i].column for i in listbox.curselection()]
+        dialog.destroy()
+    ttk.Button(frame, text="OK", command=ok).pack(pady=(15, 0))
+    dialog.grab_set()
+    root.wait_window(dialog)
+    return chosen
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+def run_with_progress(root, total, task, title="Extracting Metadata", dialog=False):
+    """Run ``task(progress, cancel)`` in a background thread while the window shows its progress.
+
+    The task reports with ``progress(done)``, or ``progress(done, total, label)``
+    to start a phase with a new total and heading. While the total is None (e.g.
+    while folders are searched) the bar only shows activity and ``done`` counts
+    the files found. The task should stop when the ``cancel`` event is set by the
+    Cancel button (or by closing the window). ``dialog`` shows the progress in a
+    window of its own instead of the main one. Tk is only touched from this
+    thread, which polls the task with ``root.after``. Returns the task's result,
+    or raises its exception.
+    """
+    import tkinter as tk
+    from tkinter import ttk
+    window = tk.Toplevel(root) if dialog else root
+    if dialog:
+        window.transient(root)
+    window.title(title)
+    frame = ttk.Frame(window, padding=20)
+    frame.pack(fill='both', expand=True)
+    heading = ttk.Label(frame, text="")
+    heading.pack(anchor=tk.W)
+    bar = ttk.Progressbar(frame, length=420, mode='determinate')
+    bar.pack(fill='x', pady=10)
+    status = ttk.Label(frame, text="Starting...")
+    status.pack(anchor=tk.W)
+    
+    state = {'done': 0, 'total': total, 'label': None}
+    def report(done, total=None, label=None):
+        if total is not None or label is not None:
+            state.update(total=total, label=label)
+        state['done'] = done
+    outcome = {}
+    cancel = threading.Event()
+    finished = tk.BooleanVar(root, False)
+    def on_cancel():
+        logging.debug("Cancel requested")
+        cancel.set()
+        cancel_button.configure(state='disabled')
+    cancel_button = ttk.Button(frame, text="Cancel", command=on_cancel)
+    cancel_button.pack(pady=(15, 0))
+    window.protocol("WM_DELETE_WINDOW", on_cancel)
+    if dialog:
+        window.grab_set()
+    
+    def work():
+        try:
+            outcome['result'] = task(report, cancel)
+        except BaseException as e:
+            outcome['error'] = e
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+    
+    # The phase shown; rate and time left are measured from its start
+    shown = {'phase': None, 'started': time.perf_counter()}
+    def poll():
+        done, total = state['done'], state['total']
+        if (total, state['label']) != shown['phase']:
+            shown.update(phase=(total, state['label']), started=time.perf_counter())
+            if total is None:
+                heading['text'] = state['label'] or "Looking for files..."
+                bar.configure(mode='indeterminate', maximum=100)
+            else:
+                heading['text'] = state['label'] or f"Reading {total} files..."
+                bar.configure(mode='determinate', maximum=max(total, 1))
+        elapsed = time.perf_counter() - shown['started']
+        if total is None:
+            bar.step(5)
+            status['text'] = "Cancelling..." if cancel.is_set() else f"{done} files found, {format_duration(elapsed)} elapsed"
+        else:
+            rate = done / elapsed if elapsed > 0 else 0
+            bar['value'] = done
+            if cancel.is_set():
+                status['text'] = f"Cancelling after {done} of {total} files..."
+            elif done >= total:
+                status['text'] = f"{done} / {total} files, finishing..."
+            else:
+                eta = format_duration((total - done) / rate) if rate else "--:--"
+                status['text'] = f"{done} / {total} files, {rate:.0f} files/s, {format_duration(elapsed)} elapsed, about {eta} left"
+        if worker.is_alive():
+            root.after(100, poll)
+        else:
+            finished.set(True)
+    root.after(100, poll)
+    root.wait_variable(finished)
+    frame.destroy()
+    if dialog:
+        window.destroy()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+def channel_name(layer):
+    # Name as in the 'Channel Name' column, e.g. '"Height Sensor" (normal)'
+    for key in (b'@2:Image Data', b'@3:Image Data'):
+        if key in layer and layer[key]:
+            return convert_channel_name(decode_value(layer[key][0])) + KEY_SUFFIXES[key]
+    return ''
+
+def selected_channels(ScanB, channels):
+    """0-based indexes of the channels of ``ScanB`` matching ``channels`` (all if None)."""
+    if channels is None:
+        return list(range(len(ScanB.layers)))
+    return [j for j, layer in enumerate(ScanB.layers)
+            if j + 1 in channels.numbers or (channels.names and any(name in channel_name(layer).lower() for name in channels.names))]
+
+def retrieve_data(ScanB, plan, channels=None):
     Meta_Data = []
     missing_columns = set()
     channel1_missing_columns = set()
-    num_channels = len(ScanB.layers)
-    logging.debug(f"Processing file with {num_channels} channels")
+    indexes = selected_channels(ScanB, channels)
+    # Checked once per file, the messages below are not even formatted when disabled
+    debug = values_log.isEnabledFor(logging.DEBUG)
+    if debug:
+        values_log.debug(f"Processing file with {len(ScanB.layers)} channels, {len(indexes)} selected")
     
-    for j in range(0, max_channels):
-        Parameters = {}
-        if j >= num_channels:
-            if 'Filename' in Columns:
-                Parameters['Filename'] = ''
-            for col in Columns:
-                if col != 'Filename' and col != 'Channel No.':
-                    Parameters[col] = 'missing'
-                    missing_columns.add(col)
-            Meta_Data.append(Parameters)
-            continue
-        
-        for col in Columns:
-            if col == 'Filename':
+    for position, j in enumerate(indexes):
+        # The real channel number, which names the channel sheets/files and fills the Channel column
+        Parameters = {'Channel': j + 1}
+        for step in plan:
+            col = step.column
+            if step.source == 'file':
+                continue
+            if step.source == 'channel':
+                Parameters[col] = str(j + 1)
                 continue
-            idx = Columns.index(col)
             try:
-                if idx < len(spm_scanner_keys):
-                    if col == 'Channel No.':
-                        Parameters[col] = str(j + 1)
-                    else:
-                        value = ScanB.scanners[0][spm_scanner_keys[idx]][0]
-                        if value is None or value == b'':
-                            Parameters[col] = 'missing'
-                            missing_columns.add(col)
-                            if j == 0:  # Only track for channel 1
-                                channel1_missing_columns.add(col)
-                            logging.debug(f"Missing data for column {col} in scanner")
-                            continue
-                        Parameters[col] = value.decode("utf-8")
-                else:
-                    if spm_layers_keys[idx - len(spm_scanner_keys)] == b'@2:Image Data':
-                        try:
-                            value = ScanB.layers[j][spm_layers_keys[idx - len(spm_scanner_keys)]][0]
-                            if value is None or value == b'':
-                                Parameters[col] = 'missing'
-                                missing_columns.add(col)
-                                if j == 0:
-                                    channel1_missing_columns.add(col)
-                                logging.debug(f"Missing data for column {col} in layers (@2:Image Data)")
-                                continue
-                            Parameters[col] = value.decode("utf-8") + ' (normal)'
-                        except KeyError:
-                            value = ScanB.layers[j][b'@3:Image Data'][0]
-                            if value is None or value == b'':
-                                Parameters[col] = 'missing'
-                                missing_columns.add(col)
-                                if j == 0:
-                                    channel1_missing_columns.add(col)
-                                logging.debug(f"Missing data for column {col} in layers (@3:Image Data)")
-                                continue
-                            Parameters[col] = value.decode("utf-8") + ' (interleave)'
-                    else:
-                        value = ScanB.layers[j][spm_layers_keys[idx - len(spm_scanner_keys)]][0]
-                        if value is None or value == b'':
-                            Parameters[col] = 'missing'
-                            missing_columns.add(col)
-                            if j == 0:
-                                channel1_missing_columns.add(col)
-                            logging.debug(f"Missing data for column {col} in layers")
-                            continue
-                        Parameters[col] = value.decode("utf-8")
+                section = ScanB.scanners[0] if step.source == 'scanner' else ScanB.layers[j]
+                for key in (step.key,) + step.fallback_keys:
+                    if key in section:
+                        break
+                value = section[key][0]
+                if value is None or value == b'':
+                    Parameters[col] = None
+                    missing_columns.add(col)
+                    if position == 0:  # Only track for the first (selected) channel
+                        channel1_missing_columns.add(col)
+                    if debug:
+                        values_log.debug(f"Missing data for column {col} in {step.source} ({key})")
+                    continue
+                Parameters[col] = decode_value(value) + KEY_SUFFIXES.get(key, '')
             except (KeyError, IndexError, AttributeError) as e:
-                logging.debug(f"Missing data for column {col}: {str(e)}")
-                Parameters[col] = 'missing'
+                if debug:
+                    values_log.debug(f"Missing data for column {col}: {str(e)}")
+                Parameters[col] = None
                 missing_columns.add(col)
-                if j == 0:
+                if position == 0:
                     channel1_missing_columns.add(col)
                 continue
         Meta_Data.append(Parameters)
     return Meta_Data, missing_columns, channel1_missing_columns
 
-def retreive_num_val(value):
-    for i in range(1, len(str(value)) + 1):
-        if not (str(value)[-i] == '.'):
-            try:
-                int(str(value)[-i])
-            except:
-                if str(value)[-i] == ':':
-                    i -= 1
-                break
-            else:
-                pass
-    return str(float(str(value)[-i:]))
-
 def get_real_aspect_ratio(spl, lines):
     AR = spl / lines
     if AR == 1:
@@ -275,96 +490,980 @@ def get_real_aspect_ratio(spl, lines):
     else:
         return AR
 
-def correct_units_and_values(dictt, Columns, NVP, Unit_dict):
-    for key, value in dictt.items():
-        if key not in NVP:
-            if value == 'missing':
-                dictt[key] = 'missing'
-                continue
+def convert_text(value):
+    return value
+
+def convert_numeric(value):
+    return parse_number(value)
+
+def convert_integer(value):
+    number = parse_number(value)
+    return int(number) if number is not None else None
+
+def convert_interleave_mode(value):
+    if len(value) > 20:
+        return value[22:-1]
+    return value
+
+def convert_channel_name(value):
+    if not (value.find(']') == -1):
+        return value[value.find(']') + 2:]
+    return value
+
+# Columns using these converters are stored as float64 (convert_integer: nullable Int64), everything else as text
+NUMERIC_CONVERTERS = (convert_numeric, convert_integer)
+
+def aspect_ratio(samples, lines):
+    if samples is None or not lines:
+        return None
+    return samples / lines
+
+def correct_units_and_values(dictt, plan):
+    # Missing values are None throughout; numbers become floats or ints, units live in the column specs
+    for step in plan:
+        value = dictt.get(step.column)
+        if value is None:
+            continue
+        dictt[step.column] = step.converter(value)
+    if 'Samples per line' in dictt and 'Lines (set.)' in dictt:
+        dictt['Asp. rat. (set.)'] = aspect_ratio(dictt['Samples per line'], dictt['Lines (set.)'])
+    if 'Samples per line' in dictt and 'Lines (real)' in dictt:
+        dictt['Asp. rat. (real)'] = aspect_ratio(dictt['Samples per line'], dictt['Lines (real)'])
+    return dictt
+
+
+class FileStageError(Exception):
+    """Raised by ``process_file`` with the stage (open, parse or extract) that failed."""
+
+    def __init__(self, stage, error):
+        super().__init__(str(error) or type(error).__name__)
+        self.stage = stage
+
+def read_file(d, data=None, layers=None):
+    # ISO/TC 201 and other non-Bruker files are rejected from their first bytes
+    reason = sniff(d) if data is None else sniff_bytes(data)
+    if reason is not None:
+        raise ValueError(reason)
+    return load_scan(d, data=data, layers=layers)
+
+def extract_header(ScanB, plan, timings=None, channels=None):
+    start = time.perf_counter()
+    Parameters, missing_cols, channel1_missing_cols = retrieve_data(ScanB, plan, channels)
+    extracted = time.perf_counter()
+    for dictt in Parameters:
+        dictt = correct_units_and_values(dictt, plan)
+    if timings is not None:
+        timings['extract'] = extracted - start
+        timings['normalize'] = time.perf_counter() - extracted
+    return len(Parameters), Parameters, channel1_missing_cols
+
+def process_file(d, plan, keep_header=False, data=None, channels=None):
+    # Stage timings travel back with the result, they are merged in the parent process
+    timings = {}
+    # Channels picked by number are all the parser needs, unless the complete header goes to the cache
+    layers = {n - 1 for n in channels.numbers} if channels is not None and not channels.names and not keep_header else None
+    stage = 'open'
+    try:
+        start = time.perf_counter()
+        if data is None:
+            data = read_header_bytes(d)
+            timings['open'] = time.perf_counter() - start
+        stage = 'parse'
+        start = time.perf_counter()
+        ScanB = read_file(d, data, layers)
+        timings['parse'] = time.perf_counter() - start
+        stage = 'extract'
+        num_channels, Parameters, channel1_missing_cols = extract_header(ScanB, plan, timings, channels)
+    except Exception as e:
+        raise FileStageError(stage, e) from e
+    # The parsed header is sent back to the parent process for the metadata cache, unless channels were skipped
+    # while parsing (the pySPM fallback always parses every channel)
+    header = (ScanB.scanners, ScanB.layers) if keep_header and not getattr(ScanB, 'skipped_layers', False) else None
+    return num_channels, Parameters, channel1_missing_cols, header, timings
+
+def _process_file_isolated(d, **kwargs):
+    # Errors are returned rather than raised so one bad file never aborts the batch
+    try:
+        return d, process_file(d, **kwargs), None
+    except FileStageError as e:
+        if isinstance(e.__cause__, MemoryError):
+            return d, None, FileError(d, 'memory', "Exceeded the memory limit per file")
+        return d, None, FileError(d, e.stage, str(e))
+
+def _limit_worker_memory(limit):
+    # Worker initializer: the address space may grow by ``limit`` bytes beyond the start-up
+    # size, a file needing more fails with MemoryError instead of exhausting the machine.
+    # RLIMIT_AS is only enforced on Linux; elsewhere the workers run without a memory limit.
+    try:
+        import resource
+        with open('/proc/self/statm') as f:
+            in_use = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = in_use + limit
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ImportError, OSError, ValueError) as e:
+        logging.debug(f"No memory limit for worker processes: {str(e)}")
+
+def _new_pool(workers, budget):
+    if budget.memory:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_limit_worker_memory, initargs=(budget.memory,))
+    return ProcessPoolExecutor(max_workers=workers)
+
+def _kill_pool(executor):
+    # A worker stuck on a file would never return, so the processes are killed rather than waited for
+    for process in list((executor._processes or {}).values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _run_alone(worker, d, data, budget):
+    # One file in a worker process of its own, so a hang or a crash is put down to that file
+    executor = _new_pool(1, budget)
+    try:
+        return executor.submit(worker, d, data=data).result(timeout=budget.seconds)
+    except FutureTimeoutError:
+        _kill_pool(executor)
+        return d, None, FileError(d, 'timeout', f"No result within {budget.seconds:g} s")
+    except BrokenProcessPool:
+        return d, None, FileError(d, 'crash', "The worker process reading it died")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _iter_pool(items, worker, workers, budget):
+    """Yield the ``worker`` results for the ``(path, data)`` ``items`` in input order.
+
+    At most ``workers * 2`` files are in flight. When the oldest one has no
+    result within ``budget.seconds`` or the pool dies under it, the pool is
+    replaced and the files in flight are rerun one at a time, so only the file
+    at fault is recorded as failed and the batch goes on.
+    """
+    executor = _new_pool(workers, budget)
+    pending = deque()
+    items = iter(items)
+    worked = False
+    try:
+        while True:
+            for d, data in items:
+                pending.append((d, data, executor.submit(worker, d, data=data)))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            d, data, future = pending[0]
             try:
-                int(str(value)[-1])
-            except:
-                for i in range(1, len(str(value)) + 1):
-                    x = str(value)[-i]
-                    try:
-                        int(x)
-                    except:
-                        pass
-                    else:
-                        dictt[key] = retreive_num_val(str(value)[:-i + 1])
-                        break
-            else:
-                dictt[key] = retreive_num_val(value)
-            dictt[key] = dictt[key] + ' ' + Unit_dict.get(key, '')
+                item = future.result(timeout=budget.seconds)
+            except (FutureTimeoutError, BrokenProcessPool) as e:
+                logging.debug(f"Worker pool stopped at {d} ({type(e).__name__}), rerunning the {len(pending)} files in flight one by one")
+                _kill_pool(executor)
+                results = []
+                while pending:
+                    d, data, future = pending.popleft()
+                    finished = future.done() and not future.cancelled() and future.exception() is None
+                    results.append(future.result() if finished else _run_alone(worker, d, data, budget))
+                if not worked and all(error is not None and error.stage == 'crash' for _, _, error in results):
+                    # No worker process ever got through a file: the pool is broken as such, not by a file
+                    raise BrokenProcessPool("No worker process could read any file")
+                worked = worked or any(error is None for _, _, error in results)
+                yield from results
+                executor = _new_pool(workers, budget)
+                continue
+            worked = True
+            pending.popleft()
+            yield item
+    finally:
+        if pending:
+            # Stopped early (cancelled): the files in flight are dropped, a stuck one is not waited for
+            _kill_pool(executor)
         else:
-            if key == 'Interleavemode':
-                if len(value) > 20:
-                    dictt[key] = dictt[key][22:-1]
-            if key == 'Channel Name':
-                if not (dictt[key].find(']') == -1):
-                    dictt[key] = dictt[key][dictt[key].find(']') + 2:]
-    if 'Samples per line' in dictt and 'Lines (set.)' in dictt:
-        if dictt['Samples per line'] != 'missing' and dictt['Lines (set.)'] != 'missing':
-            dictt['Asp. rat. (set.)'] = "{:.2f}".format(float(dictt['Samples per line']) / float(dictt['Lines (set.)']))
+            executor.shutdown()
+
+def iter_extract_files(paths, plan, workers=None, keep_header=False, prefetch=None, stats=None, channels=None, budget=None):
+    """Yield ``(path, result, error)`` for ``paths`` in input order as files finish.
+
+    ``result`` is the ``process_file`` output, or None with ``error`` (a ``FileError``) set
+    when the file failed. ``prefetch`` (default ``DEFAULT_PREFETCH``) sets how far header
+    reads run ahead of parsing; the prefetch reads are timed into ``stats``. ``channels``
+    (a ``ChannelSelection``) limits the channels extracted. ``budget`` (a ``FileBudget``,
+    default ``DEFAULT_BUDGET``) limits each file's time and memory in the worker processes,
+    also for a single file or worker; only with one worker and ``FileBudget(None, None)``
+    are files read in-process, without limits.
+    """
+    worker = partial(_process_file_isolated, plan=plan, keep_header=keep_header, channels=channels)
+    prefetch = prefetch or DEFAULT_PREFETCH
+    on_read = (lambda d, seconds: stats.add_file(d, {'open': seconds})) if stats is not None else None
+    budget = budget or DEFAULT_BUDGET
+    workers = max(1, min(workers or DEFAULT_WORKERS, len(paths)))
+    if not paths:
+        return
+    if workers == 1 and budget.seconds is None and budget.memory is None:
+        for d, data in prefetch_headers(paths, prefetch.depth, prefetch.threads, on_read=on_read):
+            yield worker(d, data=data)
+        return
+    logging.debug(f"Extracting {len(paths)} files with {workers} worker processes")
+    done = 0
+    results = _iter_pool(prefetch_headers(paths, prefetch.depth, prefetch.threads, on_read=on_read), worker, workers, budget)
+    try:
+        for item in results:
+            done += 1
+            yield item
+    except BrokenProcessPool as e:
+        logging.debug(f"Process pool failed ({str(e)}), falling back to serial extraction")
+        for d in paths[done:]:
+            yield worker(d)
+    finally:
+        # When the consumer stops early (cancelled), queued files are dropped instead of finished
+        results.close()
+
+def extract_files(paths, plan, workers=None, keep_header=False, prefetch=None, channels=None, budget=None):
+    return list(iter_extract_files(paths, plan, workers, keep_header, prefetch, channels=channels, budget=budget))
+
+
+# One entry per column: where the value lives in the header (scanner list, image
+# list of the channel, or derived from the channel index / file path), the header
+# key plus fallback keys tried in order, the unit and the value converter.
+ColumnSpec = namedtuple('ColumnSpec', ['column', 'source', 'key', 'fallback_keys', 'unit', 'converter'])
+
+COLUMN_SPECS = [
+    ColumnSpec('Channel No.', 'channel', None, (), '', convert_integer),
+    ColumnSpec('Probe', 'scanner', b'Tip Serial Number', (), '', convert_text),
+    ColumnSpec('Scan x size', 'scanner', b'Scan Size', (), 'nm', convert_numeric),
+    ColumnSpec('Scan y size (setting)', 'scanner', b'Slow Axis Size', (), 'nm', convert_numeric),
+    ColumnSpec('X Offset', 'scanner', b'X Offset', (), 'nm', convert_numeric),
+    ColumnSpec('Y Offset', 'scanner', b'Y Offset', (), 'nm', convert_numeric),
+    ColumnSpec('Scan Angle', 'scanner', b'Rotate Ang.', (), '°', convert_numeric),
+    ColumnSpec('Stagepos X', 'scanner', b'Stage X', (), 'µm', convert_numeric),
+    ColumnSpec('Stagepos Y', 'scanner', b'Stage Y', (), 'µm', convert_numeric),
+    ColumnSpec('Samples per line', 'scanner', b'Samps/line', (), '', convert_integer),
+    ColumnSpec('Lines (set.)', 'scanner', b'Lines', (), '', convert_integer),
+    ColumnSpec('Asp. rat. (set.)', 'scanner', b'Aspect Ratio', (), '', convert_numeric),
+    ColumnSpec('Scan Rate', 'scanner', b'Scan Rate', (), 'Hz', convert_numeric),
+    ColumnSpec('Tip Velocity', 'scanner', b'Tip Velocity', (), 'µm/s', convert_numeric),
+    ColumnSpec('Units', 'scanner', b'Units', (), '', convert_text),
+    ColumnSpec('Setpoint Units', 'scanner', b'Setpoint Units', (), '', convert_text),
+    ColumnSpec('Up / Down', 'scanner', b'Capture direction', (), '', convert_text),
+    ColumnSpec('Capture Type ', 'scanner', b'Capture mode ', (), '', convert_text),
+    ColumnSpec('Interleavemode', 'scanner', b'@InterleaveList', (), '', convert_interleave_mode),
+    ColumnSpec('Deflection Sens.', 'scanner', b'@Sens. DeflSens', (), 'nm/V', convert_numeric),
+    ColumnSpec('Force Sens.', 'scanner', b'@Sens. ForceDeflSens', (), 'nN/V', convert_numeric),
+    ColumnSpec('Setpoint', 'scanner', b'@2:AFMSetDeflection', (), 'V', convert_numeric),
+    ColumnSpec('IL Setpoint', 'scanner', b'@3:AFMSetDeflection', (), 'V', convert_numeric),
+    ColumnSpec('I Gain', 'scanner', b'@2:AFMFbIgain', (), '', convert_numeric),
+    ColumnSpec('P Gain', 'scanner', b'@2:AFMFbPgain', (), '', convert_numeric),
+    ColumnSpec('IL I Gain', 'scanner', b'@3:AFMFbIgain', (), '', convert_numeric),
+    ColumnSpec('IL P Gain', 'scanner', b'@3:AFMFbPgain', (), '', convert_numeric),
+    ColumnSpec('Sample Bias', 'scanner', b'@2:SSRMSampleBias', (), 'V', convert_numeric),
+    ColumnSpec('IL Sample Bias', 'scanner', b'@3:SSRMSampleBias', (), 'V', convert_numeric),
+    ColumnSpec('Lines (real)', 'layer', b'Number of lines', (), '', convert_integer),
+    ColumnSpec('Asp. rat. (real)', 'layer', b'Aspect Ratio', (), '', convert_numeric),
+    ColumnSpec('Line Direction', 'layer', b'Line Direction', (), '', convert_text),
+    ColumnSpec('Channel Name', 'layer', b'@2:Image Data', (b'@3:Image Data',), '', convert_channel_name),
+    ColumnSpec('Filename', 'file', None, (), '', convert_text),
+]
+COLUMNS = [spec.column for spec in COLUMN_SPECS]
+COLUMN_SPEC_BY_NAME = {spec.column: spec for spec in COLUMN_SPECS}
+
+# Appended to values read through these keys, to tell normal and interleave channels apart
+KEY_SUFFIXES = {b'@2:Image Data': ' (normal)', b'@3:Image Data': ' (interleave)'}
+
+PREFERRED_ORDER = ['Filename', 'Channel Name', 'Probe', 'Up / Down', 'Line Direction', 'Setpoint', 'Sample Bias', 'Scan Rate', 'Tip Velocity', 'Scan Angle', 'Lines (real)', 'Samples per line', 'Asp. rat. (real)', 'Scan x size', 'Scan y size (setting)', 'Interleavemode',
+                   'IL Sample Bias', 'IL Setpoint', 'IL I Gain', 'IL P Gain', 'I Gain', 'P Gain', 'X Offset', 'Y Offset', 'Capture Type ', 'Lines (set.)', 'Asp. rat. (set.)', 'Deflection Sens.', 'Force Sens.', 'Stagepos X', 'Stagepos Y', 'Units',
+                   'Setpoint Units']
+
+# Columns offered for selection ('Channel No.' is always derived, never picked)
+SELECTABLE_COLUMNS = [col for col in COLUMNS if col != 'Channel No.']
+
+Selection = namedtuple('Selection', ['columns', 'plan', 'order', 'channels'], defaults=(None,))
+
+# Channels to extract: 1-based numbers and/or parts of channel names (lower case), e.g. 'height' or 'interleave'
+ChannelSelection = namedtuple('ChannelSelection', ['numbers', 'names'])
+# channel_numbers: the real channel numbers found in the batch, each gets its own sheet / file;
+# skipped_files: files that were read but have no channel matching the channel selection
+BatchResult = namedtuple('BatchResult', ['file_results', 'invalid_files', 'max_channels', 'channel1_missing_columns', 'stats', 'cancelled',
+                                         'channel_numbers', 'skipped_files'], defaults=(None, False, (), ()))
+
+def header_column_spec(column, schema=None):
+    # Any header key as a column: numeric with its unit if the schema saw only numbers, else text
+    source, key = parse_header_column(column)
+    entry = schema.get(column) if schema is not None else None
+    if entry is not None and entry.numeric:
+        return ColumnSpec(column, source, key.encode('latin-1'), (), entry.unit, convert_numeric)
+    return ColumnSpec(column, source, key.encode('latin-1'), (), '', convert_text)
+
+def compile_plan(columns, schema=None):
+    # Resolved once per batch so the per-file loop only iterates over ready-made specs
+    return [COLUMN_SPEC_BY_NAME.get(col) or header_column_spec(col, schema) for col in columns]
+
+def build_selection(selected_columns, schema=None, channels=None):
+    """Selection of the known columns and ``scanner:``/``layer:`` header keys in ``selected_columns``.
+
+    ``schema`` (a ``SchemaIndex``) types the header key columns, without it they are text.
+    With ``channels`` (see ``parse_channels``) only those channels are extracted.
+    """
+    filtered_columns = [col for col in COLUMNS if col in selected_columns]
+    filtered_columns.extend([col for col in selected_columns if col not in COLUMN_SPEC_BY_NAME and parse_header_column(col)])
+    filtered_order = [col for col in PREFERRED_ORDER if col in selected_columns]
+    filtered_order.extend([col for col in filtered_columns if col not in PREFERRED_ORDER])
+    return Selection(filtered_columns, compile_plan(filtered_columns, schema), filtered_order, channels)
+
+def parse_channels(items):
+    """Turn channel numbers and names (e.g. ``[1, 'Height', 'interleave']`` or ``'1, 3'``) into a ``ChannelSelection``.
+
+    Names match any part of the 'Channel Name' value, ignoring case. Returns None
+    (all channels) if nothing is given.
+    """
+    if items is None or isinstance(items, ChannelSelection):
+        return items
+    if isinstance(items, (str, int)):
+        items = [items]
+    numbers, names = set(), []
+    for item in items:
+        for part in str(item).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if part.isdigit():
+                if int(part) < 1:
+                    raise ValueError(f"Channel numbers start at 1: {part!r}")
+                numbers.add(int(part))
+            else:
+                names.append(part.lower())
+    if not numbers and not names:
+        return None
+    return ChannelSelection(frozenset(numbers), tuple(names))
+
+def resolve_columns(names):
+    # Match user supplied names ignoring case and surrounding spaces ('Capture Type ' has a trailing one);
+    # header keys (``scanner:<key>``, ``layer:<key>``) are taken as given
+    lookup = {col.strip().lower(): col for col in COLUMNS}
+    resolved = []
+    for name in names:
+        col = lookup.get(name.strip().lower())
+        if col is None and parse_header_column(name.strip()):
+            col = name.strip()
+        if col is None:
+            raise ValueError(f"Unknown column: {name!r}")
+        if col not in resolved:
+            resolved.append(col)
+    return resolved
+
+def default_output_path(first_file, fmt='xlsx'):
+    return join(dirname(abspath(first_file)), f'Meta_Data_{datetime.now().strftime("%Y.%m.%d_%H.%M.%S")}.{fmt}')
+
+def open_cache():
+    try:
+        return HeaderCache(CACHE_FILE)
+    except sqlite3.Error as e:
+        logging.debug(f"Metadata cache unavailable ({str(e)}), reading all files")
+        return None
+
+def open_schema_cache():
+    try:
+        return SchemaCache(SCHEMA_FILE)
+    except sqlite3.Error as e:
+        logging.debug(f"Schema cache unavailable ({str(e)}), indexing all files")
+        return None
+
+def iter_headers(paths, workers=None, cache=None, prefetch=None, budget=None):
+    """Yield ``(path, (scanners, layers), error)`` for ``paths``, cached headers first.
+
+    Headers read from disk are added to the cache, so a later extraction of any
+    of their keys does not read the files again.
+    """
+    hits = {d for d in paths if cache.is_fresh(d)} if cache is not None else set()
+    for d in paths:
+        if d in hits:
+            header = cache.get(d)
+            if header is not None:
+                yield d, (header.scanners, header.layers), None
+            else:
+                # Changed since the freshness check
+                yield _cached_header(cache, *_process_file_isolated(d, plan=[], keep_header=True))
+    for item in iter_extract_files([d for d in paths if d not in hits], [], workers=workers, keep_header=True, prefetch=prefetch, budget=budget):
+        yield _cached_header(cache, *item)
+
+def _cached_header(cache, d, result, error):
+    if result is None:
+        return d, None, error
+    if cache is not None:
+        cache.put(d, *result[3])
+    return d, result[3], None
+
+def discover_schema(paths, recursive=False, workers=None, use_cache=True, prefetch=None, budget=None, progress=None, cancel=None):
+    """Index every header key found in ``paths``; return a ``SchemaIndex``.
+
+    Only headers are parsed. The index is cached per folder, so a repeated pass
+    only reads new files, and the headers read are added to the metadata cache.
+    ``schema.entries()`` lists the keys with frequency, type and unit; their
+    column names can be passed as ``columns`` to the extraction functions.
+    ``progress`` and ``cancel`` work as for ``discover``, then ``progress(done, total)``
+    follows the headers read; a cancelled pass keeps the files read so far.
+    """
+    folders = folder_signatures(discover(paths, recursive, progress=progress, cancel=cancel)[0])
+    schemas = open_schema_cache() if use_cache else None
+    cache = open_cache() if use_cache else None
+    try:
+        indexes = {}
+        missing = {}
+        for folder, signatures in folders.items():
+            indexes[folder], new = schemas.load(folder, signatures) if schemas is not None else (SchemaIndex(), list(signatures))
+            for d in new:
+                missing[d] = folder
+        logging.debug(f"Schema discovery: {len(missing)} of {sum(map(len, folders.values()))} files to read")
+        headers = iter_headers(list(missing), workers, cache, prefetch, budget)
+        try:
+            for done, (d, header, error) in enumerate(headers, 1):
+                folder = missing[d]
+                if header is None:
+                    logging.debug(f"Schema discovery skipped {d}: {error}")
+                    indexes[folder].add_failed(d, folders[folder][d])
+                else:
+                    indexes[folder].add(d, *header, folders[folder][d])
+                if progress is not None:
+                    progress(done, len(missing))
+                if cancel is not None and cancel.is_set():
+                    break
+        finally:
+            headers.close()
+        schema = SchemaIndex()
+        for folder, index in indexes.items():
+            if schemas is not None:
+                schemas.save(folder, index)
+            schema.update(index)
+        return schema
+    finally:
+        if cache is not None:
+            cache.close()
+        if schemas is not None:
+            schemas.close()
+
+def select_columns(columns=None, paths=(), recursive=False, channels=None, **schema_options):
+    # Header key columns are typed from the schema of the batch, which is only discovered when one is requested
+    columns = resolve_columns(columns) if columns is not None else SELECTABLE_COLUMNS
+    schema = discover_schema(paths, recursive, **schema_options) if any(map(parse_header_column, columns)) else None
+    return build_selection(columns, schema, parse_channels(channels))
+
+def iter_metadata(paths, selection, workers=None, cache=None, prefetch=None, stats=None, budget=None):
+    # Unchanged files are served from the cache, only the rest is read from disk
+    hits = {d for d in paths if cache.is_fresh(d)} if cache is not None else set()
+    extracted = iter_extract_files([d for d in paths if d not in hits], selection.plan, workers=workers, keep_header=cache is not None,
+                                   prefetch=prefetch, stats=stats, channels=selection.channels, budget=budget)
+    # Closing this generator early also closes the extraction, which stops the worker pool
+    try:
+        for d in paths:
+            if d not in hits:
+                _, result, error = next(extracted)
+            else:
+                header = cache.get(d)
+                if header is None:
+                    # Changed since the freshness check, read it like any other miss
+                    _, result, error = _process_file_isolated(d, plan=selection.plan, keep_header=True, channels=selection.channels)
+                else:
+                    try:
+                        timings = {}
+                        result, error = extract_header(header, selection.plan, timings, selection.channels) + (None, timings), None
+                    except Exception as e:
+                        result, error = None, FileError(d, 'extract', str(e))
+            if result is not None and result[3] is not None:
+                cache.put(d, *result[3])
+            yield d, result, error
+    finally:
+        extracted.close()
+
+def collect_metadata(paths, selection, workers=None, use_cache=True, exporter=None, prefetch=None, progress=None, cancel=None,
+                     budget=None):
+    """Extract ``paths`` into a ``BatchResult``.
+
+    ``progress(done)`` is called after every file. When the ``cancel`` event is
+    set, extraction stops after the current file and the batch holds the files
+    finished so far, with ``cancelled`` set. Files that failed are in
+    ``invalid_files`` as ``FileError`` records; ``budget`` is the ``FileBudget``
+    per file (default ``DEFAULT_BUDGET``).
+    """
+    cache = open_cache() if use_cache else None
+    try:
+        batch = _collect_metadata(paths, selection, workers, cache, exporter, prefetch, progress, cancel, budget)
+        if cache is not None:
+            batch.stats.count('cache hits', cache.hits)
+            batch.stats.count('cache misses', cache.misses)
+        return batch
+    finally:
+        if cache is not None:
+            cache.close()
+
+def _collect_metadata(paths, selection, workers, cache, exporter=None, prefetch=None, progress=None, cancel=None, budget=None):
+    stats = RunStats()
+    debug = values_log.isEnabledFor(logging.DEBUG)
+    max_channels = 0
+    channel_numbers = set()
+    # Per-file results (channel count, extracted parameters) keyed by path; each file is parsed once
+    file_results = {}
+    invalid_files = {}
+    skipped_files = []
+    all_channel1_missing_columns = set()
+    cancelled = False
+    results = iter_metadata(paths, selection, workers, cache, prefetch, stats, budget)
+    for done, (d, result, error) in enumerate(results, 1):
+        if error is not None:
+            logging.debug(f"Error processing {d} ({error.stage}): {error}")
+            invalid_files[d] = error
+            stats.count('failed')
+        elif selection.channels is not None and not result[1]:
+            # Read fine, but filtered out: not an error, and no rows in the output
+            logging.debug(f"Skipping {d}: no channel matches the channel selection")
+            skipped_files.append(d)
+            stats.count('skipped')
         else:
-            dictt['Asp. rat. (set.)'] = 'missing'
-    if 'Samples per line' in dictt and 'Lines (real)' in dictt:
-        if dictt['Samples per line'] != 'missing' and dictt['Lines (real)'] != 'missing':
-            dictt['Asp. rat. (real)'] = "{:.2f}".format(float(dictt['Samples per line']) / float(dictt['Lines (real)']))
+            num_channels, Parameters, channel1_missing_cols, header, timings = result
+            stats.add_file(d, timings)
+            stats.count('files')
+            stats.count('channels', num_channels)
+            stats.count('missing values', sum(value is None for dictt in Parameters for value in dictt.values()))
+            channel_numbers.update(dictt['Channel'] for dictt in Parameters)
+            if exporter is not None:
+                # Streamed rows go straight to the output and are not kept in memory
+                with stats.stage('write'):
+                    exporter.add_file(d, Parameters)
+                Parameters = None
+            all_channel1_missing_columns.update(channel1_missing_cols)
+            max_channels = max(max_channels, num_channels)
+            file_results[d] = (num_channels, Parameters)
+            if debug:
+                values_log.debug(f"Processed {d} with {num_channels} channels: " + ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items()))
+        if progress is not None:
+            progress(done)
+        if cancel is not None and cancel.is_set() and done < len(paths):
+            cancelled = True
+            logging.debug(f"Extraction cancelled after {done} of {len(paths)} files")
+            break
+    # Shuts the worker pool down right away if the loop was left early
+    results.close()
+    return BatchResult(file_results, invalid_files, max_channels, all_channel1_missing_columns, stats, cancelled, sorted(channel_numbers),
+                       skipped_files)
+
+def stream_metadata(paths, selection, target_path, fmt=None, layout=None, workers=None, use_cache=True, prefetch=None, progress=None,
+                    cancel=None, budget=None, rejected=None, report_errors=True, **exporter_options):
+    """Extract ``paths`` and write every file's rows to ``target_path`` as soon as it is read.
+
+    Returns ``(written, batch)``; ``batch.file_results`` only keeps the channel
+    counts (parameters are None). If the run fails partway, the rows written so
+    far are finalised before the error propagates. Files that failed, and the
+    ``rejected`` ones (path -> reason) from discovery, are written to an Errors
+    sheet / file unless ``report_errors`` is off. ``exporter_options`` go to
+    ``StreamingExporter``, e.g. to append to an existing CSV.
+    """
+    numeric_columns, units, integer_columns = column_types(selection.plan)
+    exporter = StreamingExporter(target_path, selection.order, numeric_columns, units, fmt, layout, integer_columns=integer_columns,
+                                 **exporter_options)
+    try:
+        batch = collect_metadata(paths, selection, workers, use_cache, exporter, prefetch, progress, cancel, budget)
+    except BaseException:
+        exporter.close()
+        raise
+    written = exporter.close(error_report(batch, rejected) if report_errors else None)
+    logging.info("Run summary:\n" + batch.stats.summary())
+    return written, batch
+
+def column_types(plan):
+    numeric_columns = [spec.column for spec in plan if spec.converter in NUMERIC_CONVERTERS]
+    integer_columns = [spec.column for spec in plan if spec.converter is convert_integer]
+    units = {spec.column: spec.unit for spec in plan}
+    return numeric_columns, units, integer_columns
+
+def new_result_table(columns, n_rows, plan):
+    numeric_columns, units, integer_columns = column_types(plan)
+    return ResultTable(columns, n_rows, numeric_columns, units, integer_columns=['Channel'] + integer_columns)
+
+def file_channels(batch):
+    # The channel numbers of every file, in row order
+    return [{dictt['Channel'] for dictt in Parameters} for _, Parameters in batch.file_results.values()]
+
+def build_channel_tables(batch, selection):
+    # One table per channel number in batch.channel_numbers; files without that channel keep an empty (missing) row
+    tables = []
+    for channel in batch.channel_numbers:
+        table = new_result_table(selection.order, len(batch.file_results), selection.plan)
+        for i, (d, (_, Parameters)) in enumerate(batch.file_results.items()):
+            for dictt in Parameters:
+                if dictt['Channel'] == channel:
+                    table.set_row(i, dictt)
+            if 'Filename' in selection.columns:
+                table.set_value(i, 'Filename', d)
+        tables.append(table.to_frame())
+    return tables
+
+def drift_report(batch, tables):
+    # Computed on the first channel table, which has a row for every file in scan order
+    if not tables:
+        return {}
+    summary, by_file = drift_tables(tables[0], files=list(batch.file_results))
+    return {'Drift summary': summary, 'Drift by file': by_file}
+
+def error_report(batch, rejected=None):
+    # One row per file that was rejected or failed, with the stage it failed at
+    errors = list(rejection_errors(rejected or {}).values()) + list(batch.invalid_files.values())
+    if not errors:
+        return {}
+    import pandas as pd
+    return {'Errors': pd.DataFrame(errors, columns=['File', 'Stage', 'Reason'])}
+
+def export_batch(batch, selection, target_path, fmt=None, layout=None, drift=False, rejected=None):
+    # Returns the list of files written (one per channel for the per-channel layout of CSV/Parquet/Feather)
+    stats = batch.stats or RunStats()
+    with stats.stage('write'):
+        tables = build_channel_tables(batch, selection)
+        extra_tables = {**(drift_report(batch, tables) if drift else {}), **error_report(batch, rejected)}
+        written = export_tables(tables, selection.order, target_path, fmt, layout, file_channels(batch), extra_tables,
+                                batch.channel_numbers)
+    logging.info("Run summary:\n" + stats.summary())
+    return written
+
+def extract_metadata(paths, columns=None, workers=None, use_cache=True, recursive=False, prefetch=None, channels=None, budget=None):
+    """Extract metadata without any GUI and return one row per file and channel.
+
+    ``paths`` may contain files and directories (with ``recursive``, whole
+    directory trees), ``columns`` defaults to every selectable column and may
+    include any header key found by ``discover_schema``. ``channels`` picks
+    channels by number and/or name (see ``parse_channels``), default all. Numeric columns are float64 with NaN for missing values
+    and their units in ``df.attrs['units']``. Files that could not be read are
+    listed with a ``FileError`` (file, stage, reason) in ``df.attrs['invalid_files']``,
+    files without a channel matching ``channels`` in ``df.attrs['skipped_files']``.
+    ``prefetch`` is a ``Prefetch(depth, threads)`` for reading headers ahead (default
+    ``DEFAULT_PREFETCH``), ``budget`` the ``FileBudget`` per file (default ``DEFAULT_BUDGET``).
+    """
+    selection = select_columns(columns, paths, recursive, channels, workers=workers, use_cache=use_cache, prefetch=prefetch, budget=budget)
+    files, rejected = discover(paths, recursive)
+    batch = collect_metadata(files, selection, workers, use_cache, prefetch=prefetch, budget=budget)
+    table = new_result_table(['Channel'] + selection.order, sum(num_channels for num_channels, _ in batch.file_results.values()), selection.plan)
+    i = 0
+    for d, (_, Parameters) in batch.file_results.items():
+        for Parameters_j in Parameters:
+            table.set_row(i, Parameters_j)
+            if 'Filename' in selection.columns:
+                table.set_value(i, 'Filename', d)
+            i += 1
+    df = table.to_frame()
+    df.attrs['invalid_files'] = rejection_errors(rejected)
+    df.attrs['invalid_files'].update(batch.invalid_files)
+    df.attrs['skipped_files'] = list(batch.skipped_files)
+    return df
+
+def export_metadata(paths, target_path, columns=None, fmt=None, layout=None, workers=None, use_cache=True, stream=None, recursive=False,
+                    prefetch=None, channels=None, drift=False, budget=None):
+    """Extract metadata and write it to ``target_path``; return the list of files written.
+
+    ``fmt`` is one of ``FORMATS`` (default: from the file extension, else xlsx) and
+    ``layout`` one of ``LAYOUTS`` (default: per-channel sheets for xlsx, one long
+    table otherwise). ``stream`` writes rows as files finish with flat memory; by
+    default it is used for batches of ``STREAM_THRESHOLD`` files or more.
+    ``channels`` limits the channels exported (see ``parse_channels``). ``drift``
+    adds a report of the parameters that change between scans (see ``drift.py``);
+    it needs the whole batch in memory and cannot be streamed. Files that were
+    rejected or failed are listed with the stage and reason in an Errors sheet
+    (Excel) or an extra ``<name>_Errors`` file.
+    """
+    if stream and drift:
+        raise ValueError("The drift report cannot be combined with streaming")
+    selection = select_columns(columns, paths, recursive, channels, workers=workers, use_cache=use_cache, prefetch=prefetch, budget=budget)
+    files, rejected = discover(paths, recursive)
+    if stream or (stream is None and not drift and len(files) >= STREAM_THRESHOLD):
+        return stream_metadata(files, selection, target_path, fmt, layout, workers, use_cache, prefetch, budget=budget, rejected=rejected)[0]
+    batch = collect_metadata(files, selection, workers, use_cache, prefetch=prefetch, budget=budget)
+    return export_batch(batch, selection, target_path, fmt, layout, drift, rejected)
+
+def manifest_path(target_path):
+    return target_path + '.manifest.json'
+
+def update_export(paths, target_path, columns=None, fmt=None, layout=None, workers=None, use_cache=True, recursive=False, prefetch=None,
+                  channels=None, budget=None):
+    """Bring the incremental export at ``target_path`` up to date; return ``(written, batch)``.
+
+    A manifest next to the output records what has been exported, so only new
+    or changed files are read. New files are appended in place to CSV output;
+    any other change (other formats, changed or removed files, new settings)
+    rewrites the output with the unchanged files served from the metadata cache.
+    ``written`` is empty if nothing changed, ``batch`` covers the files exported
+    in this update (all of them after a rewrite).
+    """
+    fmt = fmt or format_from_path(target_path)
+    layout = layout or DEFAULT_LAYOUTS[fmt]
+    selection = select_columns(columns, paths, recursive, channels, workers=workers, use_cache=use_cache, prefetch=prefetch, budget=budget)
+    settings = {'format': fmt, 'layout': layout, 'columns': selection.order,
+                'channels': [sorted(selection.channels.numbers), list(selection.channels.names)] if selection.channels else None}
+    manifest = ExportManifest(manifest_path(target_path))
+    if not manifest.is_usable(settings):
+        manifest.reset(settings)
+    
+    # Only new and changed files are sniffed, the others are known from the manifest
+    files = discover(paths, recursive, check_magic=False)[0]
+    new, changed, removed = manifest.changes(files)
+    candidates, rejected = check_magic_bytes(new + changed)
+    rejected = rejection_errors(rejected)
+    for d in rejected:
+        manifest.record(d, ok=False)
+    if not candidates and not changed and not removed and manifest.written:
+        manifest.save()
+        return [], BatchResult({}, rejected, 0, set(), RunStats())
+    
+    logging.debug(f"Incremental update of {target_path}: {len(new)} new, {len(changed)} changed, {len(removed)} removed")
+    try:
+        if fmt == 'csv' and manifest.written and not changed and not removed:
+            # The errors of earlier updates are not read again, so the errors file is left as it is
+            written, batch = stream_metadata(candidates, selection, target_path, fmt, layout, workers, use_cache, prefetch, budget=budget,
+                                             report_errors=False, existing_files=list(manifest.files),
+                                             existing_channels=manifest.channels)
+            written = manifest.written + [path for path in written if path not in manifest.written]
         else:
-            dictt['Asp. rat. (real)'] = 'missing'
-    if 'Channel No.' in dictt:
-        dictt['Channel No.'] = str(int(dictt['Channel No.'][0]))
-    if 'Lines (real)' in dictt and dictt['Lines (real)'] != 'missing':
-        dictt['Lines (real)'] = str(int(float(dictt['Lines (real)'])))
-    if 'Lines (set.)' in dictt and dictt['Lines (set.)'] != 'missing':
-        dictt['Lines (set.)'] = str(int(float(dictt['Lines (set.)'])))
-    if 'Samples per line' in dictt and dictt['Samples per line'] != 'missing':
-        dictt['Samples per line'] = str(int(float(dictt['Samples per line'])))
-    return dictt
+            candidates = set(candidates)
+            files = [d for d in files if d in candidates or (d in manifest.files and d not in removed)]
+            previous = manifest.written
+            manifest.files = {}
+            manifest.channels = []
+            if len(files) >= STREAM_THRESHOLD:
+                written, batch = stream_metadata(files, selection, target_path, fmt, layout, workers, use_cache, prefetch, budget=budget)
+            else:
+                batch = collect_metadata(files, selection, workers, use_cache, prefetch=prefetch, budget=budget)
+                written = export_batch(batch, selection, target_path, fmt, layout) if batch.file_results else []
+            # Channel files that no longer exist in the new output
+            for path in previous:
+                if path not in written and os.path.exists(path):
+                    os.remove(path)
+    except BaseException:
+        # The output may be partly written, the next update starts from scratch
+        manifest.reset(settings)
+        manifest.save()
+        raise
+    for d in batch.file_results:
+        manifest.record(d)
+    for d in batch.invalid_files:
+        manifest.record(d, ok=False)
+    for d in batch.skipped_files:
+        manifest.record(d, skipped=True)
+    manifest.channels = sorted(set(manifest.channels) | set(batch.channel_numbers))
+    manifest.written = written
+    manifest.save()
+    batch.invalid_files.update(rejected)
+    return written, batch
 
+def watch_export(paths, target_path, interval=60, polls=None, on_update=None, **options):
+    """Keep the export at ``target_path`` up to date, checking ``paths`` every ``interval`` seconds.
 
+    Runs until interrupted, or for ``polls`` updates. ``on_update(written, batch)``
+    is called after every update; ``options`` are passed to ``update_export``.
+    The folder is polled rather than watched for events, which also works on
+    network shares.
+    """
+    n = 0
+    while True:
+        written, batch = update_export(paths, target_path, **options)
+        if on_update is not None:
+            on_update(written, batch)
+        n += 1
+        if polls is not None and n >= polls:
+            return
+        time.sleep(interval)
 
-# [create_gui, retrieve_data, retreive_num_val, correct_units_and_values unchanged]
+def index_metadata(paths, recursive=False, columns=None, workers=None, use_cache=True, prefetch=None, index_file=None, progress=None,
+                   cancel=None, budget=None):
+    """Add ``paths`` to the metadata index at ``index_file`` (default ``INDEX_FILE``); return the ``BatchResult``.
 
-def main():
-    from datetime import datetime
-    import re
-    import os
-    logging.debug("Entering main")
-    Columns = [
-        'Channel No.', 'Probe', 'Scan x size', 'Scan y size (setting)', 'X Offset', 'Y Offset',
-        'Scan Angle', 'Stagepos X', 'Stagepos Y', 'Samples per line', 'Lines (set.)',
-        'Asp. rat. (set.)', 'Scan Rate', 'Tip Velocity', 'Units', 'Setpoint Units',
-        'Up / Down', 'Capture Type ', 'Interleavemode', 'Deflection Sens.', 'Force Sens.',
-        'Setpoint', 'IL Setpoint', 'I Gain', 'P Gain', 'IL I Gain', 'IL P Gain',
-        'Sample Bias', 'IL Sample Bias', 'Lines (real)', 'Asp. rat. (real)', 'Line Direction',
-        'Channel Name'
-    ]
-    NVP = ['Probe', 'Units', 'Setpoint Units', 'Up / Down', 'Capture Type ', 'Interleavemode', 'Line Direction', 'Channel Name']
+    Only files that are new or changed since they were last indexed are read,
+    indexed files below the given directories that are gone are dropped. Rows go
+    straight into the database, memory stays flat for any archive size. An
+    index built with other ``columns`` is rebuilt.
+    """
+    selection = select_columns(columns, paths, recursive, workers=workers, use_cache=use_cache, prefetch=prefetch, budget=budget)
+    numeric_columns, units, integer_columns = column_types(selection.plan)
+    with MetadataIndex(index_file or INDEX_FILE) as index:
+        index.configure([col for col in selection.order if col != 'Filename'], numeric_columns, units, INDEXED_COLUMNS, integer_columns)
+        files = discover(paths, recursive, check_magic=False)[0]
+        pruned = index.prune(paths, files)
+        candidates, rejected = check_magic_bytes(index.changes(files))
+        rejected = rejection_errors(rejected)
+        logging.debug(f"Indexing {len(candidates)} of {len(files)} files into {index.db_path}, {pruned} removed")
+        for d, error in rejected.items():
+            index.add_failed(d, str(error))
+        batch = collect_metadata(candidates, selection, workers, use_cache, exporter=index, prefetch=prefetch, progress=progress,
+                                 cancel=cancel, budget=budget)
+        for d, error in batch.invalid_files.items():
+            index.add_failed(d, str(error))
+    batch.invalid_files.update(rejected)
+    logging.info("Run summary:\n" + batch.stats.summary())
+    return batch
+
+def query_index(filters=(), columns=None, index_file=None):
+    """Return the indexed channels matching all ``filters`` as a DataFrame, one row per file and channel.
+
+    Filters read like ``Scan Rate > 1 Hz``, ``Sample Bias between -2 and 0.5``,
+    ``Probe = SCANASYST-AIR-338`` or ``Channel Name ~ Height`` (contains); numbers
+    are compared in the column's unit. Returns ``Filename``, ``Channel`` and
+    ``columns`` (default: all indexed columns), with units in ``df.attrs['units']``.
+    """
+    import pandas as pd
+    with MetadataIndex(index_file or INDEX_FILE) as index:
+        names, rows = index.query(filters, [col for col in resolve_columns(columns) if col != 'Filename'] if columns is not None else None)
+        units = {col: unit for col, unit in index.units.items() if col in names}
+    df = pd.DataFrame.from_records(rows, columns=names)
+    df.attrs['units'] = units
+    return df
+
+def cli(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='MetaDataReader', description="Extract metadata from Bruker .spm/.NNN files without the GUI.")
+    parser.add_argument('paths', nargs='*', help="Files or directories to read")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Also read the subdirectories of the given directories")
+    # One value per option (comma separated, repeatable) so the options never swallow the paths that follow
+    parser.add_argument('--columns', action='append', help="Columns to export, comma separated (default: all), e.g. "
+                        "--columns 'Filename,Scan Rate'; any header key as scanner:<key> or layer:<key>, see --schema")
+    parser.add_argument('--channels', action='append', help="Channels to export, by number and/or part of the channel name, comma "
+                        "separated, e.g. --channels 1 or --channels Height,interleave (default: all)")
+    parser.add_argument('--out', help="Output file (default: Meta_Data_<timestamp>.<format> next to the first file)")
+    parser.add_argument('--format', choices=list(FORMATS), help="Output format (default: from --out extension, else xlsx)")
+    parser.add_argument('--layout', choices=list(LAYOUTS), help="One sheet/file per channel, or one long table with a Channel column")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of worker processes (1 = serial)")
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH.depth, metavar='N', help="Read the headers of up to N files ahead of parsing (0 = off)")
+    parser.add_argument('--io-threads', type=int, default=DEFAULT_PREFETCH.threads, metavar='N', help="Number of threads reading headers ahead")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_BUDGET.seconds, metavar='SECONDS',
+                        help="Give up on a file after SECONDS in its worker process (0 = no limit, default: %(default)s)")
+    parser.add_argument('--memory-limit', type=int, default=DEFAULT_BUDGET.memory // 2**20, metavar='MB',
+                        help="Memory a worker process may use per file, Linux only (0 = no limit, default: %(default)s)")
+    parser.add_argument('--drift', action='store_true', help="Add a report of the parameters that change between scans and against the batch mode "
+                        "(extra sheets in Excel, extra files otherwise)")
+    parser.add_argument('--stream', action='store_true', help=f"Write rows as files finish with flat memory (default for {STREAM_THRESHOLD}+ files)")
+    parser.add_argument('--no-cache', action='store_true', help="Ignore the metadata cache and re-read every file")
+    parser.add_argument('--incremental', action='store_true', help="Only add files that are new or changed since the last run to --out")
+    parser.add_argument('--watch', type=float, metavar='SECONDS', help="Keep --out up to date, checking for new files every SECONDS")
+    parser.add_argument('--list-columns', action='store_true', help="Print the available columns and exit")
+    parser.add_argument('--index', action='store_true', help="Add the input files to the metadata index (only new or changed files are read) and exit")
+    parser.add_argument('--query', nargs='+', metavar='FILTER', help="Print the indexed scans matching all filters as CSV, "
+                        "e.g. --query 'Scan Rate > 1 Hz' 'Probe ~ SCANASYST' (--columns picks the columns shown)")
+    parser.add_argument('--index-file', default=INDEX_FILE, help="Metadata index database (default: %(default)s)")
+    parser.add_argument('--schema', action='store_true', help="Print every header key found in the input files with its frequency, type and unit, and exit")
+    parser.add_argument('--debug', action='store_true', help="Also log every missing value and the timings of every file")
+    parser.add_argument('--profile', metavar='FILE', help="Write cProfile stats of the run to FILE (worker processes are not profiled, "
+                        "see --workers 1 --timeout 0 --memory-limit 0)")
+    args = parser.parse_args(argv)
+    if args.debug:
+        # Worker processes pick the level up from the environment
+        os.environ['META_DATA_READER_DEBUG'] = '1'
+        values_log.setLevel(logging.DEBUG)
+    with profiled(args.profile):
+        return _run_cli(parser, args)
+
+def _run_cli(parser, args):
+    if args.list_columns:
+        print("\n".join(SELECTABLE_COLUMNS))
+        return 0
+    try:
+        columns = resolve_columns([name for item in args.columns for name in item.split(',') if name.strip()]) if args.columns else SELECTABLE_COLUMNS
+    except ValueError as e:
+        parser.error(str(e))
+    if args.query:
+        try:
+            df = query_index(args.query, columns if args.columns else None, args.index_file)
+        except ValueError as e:
+            parser.error(str(e))
+        with_unit_headers(df).to_csv(sys.stdout, index=False, lineterminator='\n')
+        print(f"{df['Filename'].nunique()} files, {len(df)} channels match", file=sys.stderr)
+        return 0
+    if not args.paths:
+        parser.error("no input files or directories given")
     
-    Units = [
-        '', '', 'nm', 'nm', 'nm', 'nm', '°', 'µm', 'µm', '', '', '', 'Hz', 'µm/s', '', '',
-        '', '', '', 'nm/V', 'nN/V', 'V', 'V', '', '', '', '', 'V', 'V', '', '', '', ''
-    ]
-    Unit_dict = dict(zip(Columns, Units))
+    prefetch = Prefetch(args.prefetch, args.io_threads)
+    budget = FileBudget(args.timeout or None, args.memory_limit * 2**20 or None)
+    try:
+        channels = parse_channels(args.channels)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.schema:
+        schema = discover_schema(args.paths, args.recursive, args.workers, use_cache=not args.no_cache, prefetch=prefetch, budget=budget)
+        print(f"{len(schema.files)} files indexed, {len(schema.failed)} could not be read")
+        for entry in schema.entries():
+            kind = (f"number [{entry.unit}]" if entry.unit else "number") if entry.numeric else "text"
+            print(f"{entry.column}\t{entry.files}\t{kind}\t{entry.example}")
+        return 0
+    if args.index:
+        batch = index_metadata(args.paths, args.recursive, columns if args.columns else None, args.workers, not args.no_cache, prefetch,
+                               args.index_file, budget=budget)
+        for d, error in batch.invalid_files.items():
+            print(f"Error processing {d} ({error.stage}): {error}", file=sys.stderr)
+        print(f"{len(batch.file_results)} files added to {args.index_file}")
+        print(batch.stats.summary())
+        return 0
+    if args.stream and args.drift:
+        parser.error("--drift needs the whole batch and cannot be combined with --stream")
+    if args.incremental or args.watch is not None:
+        if not args.out:
+            parser.error("--incremental and --watch need --out")
+        if args.drift:
+            parser.error("--drift is not available with --incremental and --watch")
+        def report(written, batch):
+            for d, error in batch.invalid_files.items():
+                print(f"Error processing {d} ({error.stage}): {error}", file=sys.stderr)
+            print(f"{len(batch.file_results)} files exported to " + ", ".join(written) if written else "Output is up to date.")
+        options = dict(columns=columns, fmt=args.format, layout=args.layout, workers=args.workers, use_cache=not args.no_cache, recursive=args.recursive,
+                       prefetch=prefetch, channels=args.channels, budget=budget)
+        try:
+            if args.watch is not None:
+                watch_export(args.paths, args.out, args.watch, on_update=report, **options)
+            else:
+                report(*update_export(args.paths, args.out, **options))
+        except ImportError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        except KeyboardInterrupt:
+            pass
+        return 0
     
-    spm_scanner_keys = [
-        b'0', b'Tip Serial Number', b'Scan Size', b'Slow Axis Size', b'X Offset', b'Y Offset',
-        b'Rotate Ang.', b'Stage X', b'Stage Y', b'Samps/line', b'Lines', b'Aspect Ratio',
-        b'Scan Rate', b'Tip Velocity', b'Units', b'Setpoint Units', b'Capture direction',
-        b'Capture mode ', b'@InterleaveList', b'@Sens. DeflSens', b'@Sens. ForceDeflSens',
-        b'@2:AFMSetDeflection', b'@3:AFMSetDeflection', b'@2:AFMFbIgain', b'@2:AFMFbPgain',
-        b'@3:AFMFbIgain', b'@3:AFMFbPgain', b'@2:SSRMSampleBias', b'@3:SSRMSampleBias'
-    ]
-    spm_layers_keys = [
-        b'Number of lines', b'Aspect Ratio', b'Line Direction', b'@2:Image Data'
-    ]
+    valid_files, rejected = discover(args.paths, args.recursive)
+    for d, reason in rejected.items():
+        print(f"Skipping {d}: {reason}", file=sys.stderr)
+    selection = select_columns(columns, valid_files, channels=channels, workers=args.workers, use_cache=not args.no_cache, prefetch=prefetch,
+                               budget=budget)
+    fmt = args.format or (format_from_path(args.out) if args.out else 'xlsx')
+    target_path = args.out or (default_output_path(valid_files[0], fmt) if valid_files else None)
+    try:
+        if valid_files and (args.stream or (not args.drift and len(valid_files) >= STREAM_THRESHOLD)):
+            written, batch = stream_metadata(valid_files, selection, target_path, fmt, args.layout, args.workers, use_cache=not args.no_cache,
+                                             prefetch=prefetch, budget=budget, rejected=rejected)
+        else:
+            batch = collect_metadata(valid_files, selection, args.workers, use_cache=not args.no_cache, prefetch=prefetch, budget=budget)
+            written = export_batch(batch, selection, target_path, fmt, args.layout, args.drift, rejected) if batch.file_results else []
+    except ImportError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    for d, error in batch.invalid_files.items():
+        print(f"Error processing {d} ({error.stage}): {error}", file=sys.stderr)
+    for d in batch.skipped_files:
+        print(f"Skipping {d}: no channel matches the channel selection", file=sys.stderr)
+    if not batch.file_results:
+        print("No file has a channel matching the selection." if batch.skipped_files else "No valid files processed.", file=sys.stderr)
+        return 1
+    
+    success_msg = f"{FORMATS[fmt]} created successfully at " + ", ".join(written) + f"\n\n{len(batch.file_results)} files processed successfully."
+    if batch.skipped_files:
+        success_msg += f"\n{len(batch.skipped_files)} files have no channel matching the selection and were skipped."
+    logging.debug(success_msg)
+    print(success_msg)
+    print(batch.stats.summary())
+    return 0
+
+def main():
+    import tkinter as tk
+    from tkinter import filedialog as fd, messagebox as mb
+    logging.debug("Entering main")
     
     root = tk.Tk()
+    threading.Thread(target=preload_modules, daemon=True).start()
+    # Kept across GUI rounds so the last chosen output format sticks
+    format_var = tk.StringVar(root, FORMATS['xlsx'])
+    layout_var = tk.StringVar(root, LAYOUTS[DEFAULT_LAYOUTS['xlsx']])
+    folder_var = tk.BooleanVar(root, False)
+    channels_var = tk.StringVar(root, '')
+    drift_var = tk.BooleanVar(root, False)
     while True:
         try:
-            selected_columns = create_gui(root, [col for col in Columns if col != 'Channel No.'] + ['Filename'])
+            selected_columns = create_gui(root, SELECTABLE_COLUMNS, (format_var, layout_var, folder_var, channels_var, drift_var))
         except Exception as e:
             logging.debug(f"Error in create_gui: {str(e)}")
             print(f"Error in create_gui: {str(e)}")
@@ -379,27 +1478,16 @@ def main():
             root.destroy()
             return
         
-        preferred_order = ['Filename', 'Channel Name', 'Probe', 'Up / Down', 'Line Direction', 'Setpoint', 'Sample Bias', 'Scan Rate', 'Tip Velocity', 'Scan Angle', 'Lines (real)', 'Samples per line', 'Asp. rat. (real)', 'Scan x size', 'Scan y size (setting)', 'Interleavemode',
-                          'IL Sample Bias', 'IL Setpoint', 'IL I Gain', 'IL P Gain', 'I Gain', 'P Gain', 'X Offset', 'Y Offset', 'Capture Type ', 'Lines (set.)', 'Asp. rat. (set.)', 'Deflection Sens.', 'Force Sens.', 'Stagepos X', 'Stagepos Y', 'Units',
-                          'Setpoint Units']
-        
-        filtered_columns = [col for col in Columns if col in selected_columns]
-        if 'Filename' in selected_columns:
-            filtered_columns.append('Filename')
-        filtered_scanner_keys = [spm_scanner_keys[Columns.index(col)] for col in filtered_columns if col in Columns and Columns.index(col) < len(spm_scanner_keys)]
-        filtered_layers_keys = [spm_layers_keys[Columns.index(col) - len(spm_scanner_keys)] for col in filtered_columns if col in Columns and Columns.index(col) >= len(spm_scanner_keys)]
-        filtered_NVP = [col for col in NVP if col in filtered_columns]
-        filtered_unit_dict = {col: Unit_dict.get(col, '') for col in filtered_columns}
-        
-        filtered_order = [col for col in preferred_order if col in selected_columns]
-        filtered_order.extend([col for col in selected_columns if col not in preferred_order])
-        
         logging.debug("Opening file dialog")
         try:
-            filez = fd.askopenfilenames(
-                parent=root,
-                title="Choose SPM or Numeric Files"
-            )
+            if folder_var.get():
+                folder = fd.askdirectory(parent=root, title="Choose a Folder with SPM or Numeric Files")
+                filez = [folder] if folder else []
+            else:
+                filez = fd.askopenfilenames(
+                    parent=root,
+                    title="Choose SPM or Numeric Files"
+                )
             logging.debug(f"Selected files: {filez}")
             print(f"Selected files: {filez}")
             if not filez:
@@ -426,117 +1514,105 @@ def main():
                 mb.showwarning("No Files Selected", "Please select valid .spm files.")
                 continue
         
-        # Validate extensions
-        invalid_extensions = []
-        valid_files = []
-        for d in filez:
-            ext = os.path.splitext(d)[1].lower()
-            if ext == '.spm' or re.match(r'^\.\d{3}$', ext):
-                valid_files.append(d)
-                logging.debug(f"Valid extension detected: {d}")
+        drift = drift_var.get()
+        try:
+            channels = parse_channels(channels_var.get())
+        except ValueError as e:
+            mb.showwarning("Invalid Channels", str(e))
+            continue
+        fmt = {label: key for key, label in FORMATS.items()}[format_var.get()]
+        layout = {label: key for key, label in LAYOUTS.items()}[layout_var.get()]
+        
+        # Everything from the folder walk on runs in the background, a large share never freezes the window
+        def extract_and_export(progress, cancel):
+            # Validate extensions and magic bytes, a folder is expanded to its whole tree
+            def report(done, total=None):
+                progress(done, total, None if total is None else f"Checking {total} files...")
+            valid_files, rejected = discover(filez, recursive=True, progress=report, cancel=cancel)
+            if cancel.is_set():
+                return None
+            if not valid_files:
+                return valid_files, rejected, None, [], None
+            progress(0, len(valid_files), f"Reading {len(valid_files)} files...")
+            target_path = default_output_path(valid_files[0], fmt)
+            selection = select_columns(selected_columns, valid_files, channels=channels)
+            # The drift report needs the whole batch, it is never streamed
+            if len(valid_files) >= STREAM_THRESHOLD and not drift:
+                written, batch = stream_metadata(valid_files, selection, target_path, fmt, layout, progress=progress, cancel=cancel,
+                                                 rejected=rejected)
             else:
-                invalid_extensions.append(d)
-                logging.debug(f"Invalid extension detected: {d}")
+                batch = collect_metadata(valid_files, selection, progress=progress, cancel=cancel)
+                written = export_batch(batch, selection, target_path, fmt, layout, drift, rejected) if batch.file_results else []
+            return valid_files, rejected, target_path, written, batch
+        try:
+            outcome = run_with_progress(root, None, extract_and_export)
+        except ImportError as e:
+            logging.debug(f"Export failed: {str(e)}")
+            mb.showerror("Export Failed", str(e))
+            continue
+        if outcome is None:
+            mb.showinfo("Cancelled", "Cancelled while looking for files, nothing was read.")
+            continue
+        valid_files, rejected, target_path, written, batch = outcome
         
-        # Show warning for invalid files and exit if no valid files
+        invalid_extensions = [d for d, reason in rejected.items() if reason == "Unsupported extension"]
+        for d, reason in rejected.items():
+            logging.debug(f"Rejected {d}: {reason}")
+        if folder_var.get() and not valid_files and not rejected:
+            mb.showwarning("No Files Found", f"No .spm or numeric files found in {filez[0]}.")
+            continue
+        
+        # Show warning for invalid files and go back if no valid files
         if invalid_extensions:
-            invalid_msg = "The following files have unsupported extensions and will be skipped:\n" + "\n".join(invalid_extensions) + "\n\nProcessing valid .spm files."
+            invalid_msg = "The following files have unsupported extensions and were skipped:\n" + "\n".join(invalid_extensions)
+            if valid_files:
+                invalid_msg += "\n\nThe valid .spm files were processed."
             mb.showwarning("Invalid Files Skipped", invalid_msg)
             logging.debug(invalid_msg)
             print(invalid_msg)
             if not valid_files:
                 continue
         
-        max_channels = 0
-        channel_counts = {}
-        raw_data = []
-        all_channel1_missing_columns = set()
         invalid_files = invalid_extensions
-        
-        # Process valid files
-        for d in valid_files:
-            try:
-                logging.debug(f"Checking channels for file: {d}")
-                with open(d, 'r', encoding='utf-8', errors='ignore') as f:
-                    first_line = f.readline().strip()
-                    if 'ISO/TC 201 SPM data transfer format' in first_line:
-                        logging.debug(f"Invalid file format (ISO/TC 201): {d}")
-                        invalid_files.append(d)
-                        continue
-                ScanB = Bruker(d)
-                num_channels = len(ScanB.layers)
-                channel_counts[d] = num_channels
-                max_channels = max(max_channels, num_channels)
-                logging.debug(f"Valid file with {num_channels} channels: {d}")
-            except Exception as e:
-                logging.debug(f"Error checking channels for {d}: {str(e)}")
-                print(f"Error checking channels for {d}: {str(e)}")
+        for d, reason in rejected.items():
+            if reason != "Unsupported extension":
+                print(f"Error processing {d}: {reason}")
                 invalid_files.append(d)
-                continue
+        if not valid_files:
+            invalid_msg = "The following files were not processed due to incompatible format or errors:\n" + "\n".join(invalid_files) + "\n\nPlease choose valid .spm files."
+            mb.showwarning("No Valid Files Processed", invalid_msg)
+            continue
+        
+        for d, error in batch.invalid_files.items():
+            print(f"Error processing {d} ({error.stage}): {error}")
+            invalid_files.append(d)
         
+        channel_counts = {d: num_channels for d, (num_channels, _) in batch.file_results.items()}
         if len(set(channel_counts.values())) > 1:
-            message = f"Not all files have the same number of data channels. Output includes all channels up to the maximum ({max_channels})."
+            message = ("Not all files have the same number of data channels. Output includes every channel found ("
+                       + ", ".join(str(n) for n in batch.channel_numbers) + ").")
             mb.showwarning("Channel Count Mismatch", message)
             logging.debug(f"Channel count mismatch: {channel_counts}")
         
-        for d in valid_files:
-            if d in invalid_files:
+        if not batch.file_results:
+            for path in written:
+                os.remove(path)
+            if batch.cancelled:
+                mb.showinfo("Cancelled", "Extraction was cancelled before any file was processed.")
                 continue
-            try:
-                logging.debug(f"Processing file: {d}")
-                ScanB = Bruker(d)
-                Parameters, missing_cols, channel1_missing_cols = retrieve_data(ScanB, filtered_columns, filtered_scanner_keys, filtered_layers_keys, max_channels)
-                all_channel1_missing_columns.update(channel1_missing_cols)
-                for dictt in Parameters:
-                    dictt = correct_units_and_values(dictt, filtered_columns, filtered_NVP, filtered_unit_dict)
-                raw_data.append(Parameters)
-                logging.debug(f"Successfully processed file: {d}")
-            except Exception as e:
-                logging.debug(f"Error processing {d}: {str(e)}")
-                print(f"Error processing {d}: {str(e)}")
-                invalid_files.append(d)
+            if batch.skipped_files and not batch.invalid_files:
+                mb.showwarning("No Matching Channels", f"None of the {len(batch.skipped_files)} files has a channel matching the selection.")
                 continue
-        
-        if invalid_files and not raw_data:
             invalid_msg = "The following files were not processed due to incompatible format or errors:\n" + "\n".join(invalid_files) + "\n\nPlease choose valid .spm files."
             mb.showwarning("No Valid Files Processed", invalid_msg)
             continue
         
         # Show missing columns warning for channel 1 only
-        if all_channel1_missing_columns:
-            missing_msg = "\n".join(f"Missing data for column {col}" for col in sorted(all_channel1_missing_columns))
-            logging.debug(f"Missing columns: {all_channel1_missing_columns}")
-        
-        outer_list = []
-        for channel in range(0, max_channels):
-            inner_list = []
-            for file in range(0, len(raw_data)):
-                inner_list.append(raw_data[file][channel])
-                if 'Filename' in filtered_columns:
-                    inner_list[-1].update({'Filename': valid_files[file]})
-            outer_list.append(inner_list)
+        if batch.channel1_missing_columns:
+            missing_msg = "\n".join(f"Missing data for column {col}" for col in sorted(batch.channel1_missing_columns))
+            logging.debug(f"Missing columns: {batch.channel1_missing_columns}")
         
-        target_path = join(dirname(abspath(valid_files[0])), f'Meta_Data_{datetime.now().strftime("%Y.%m.%d_%H.%M.%S")}.xlsx')
-        with pd.ExcelWriter(target_path) as writer:
-            for i in range(0, len(outer_list)):
-                df = pd.DataFrame(outer_list[i])
-                df = df.reindex(columns=filtered_order)
-                df.to_excel(writer, sheet_name='Channel' + str(i + 1), index=True)
-                workbook = writer.book
-                worksheet = writer.sheets['Channel' + str(i + 1)]
-                format1 = workbook.add_format({'num_format': '#,##0.00', 'align': 'center'})
-                format1.set_font_size(8)
-                format2 = workbook.add_format({'num_format': '@', 'align': 'right'})
-                format2.set_font_size(14)
-                format_index = workbook.add_format({'align': 'center'})
-                format_index.set_font_size(8)
-                worksheet.set_column(0, 0, 5, format_index)
-                for col in range(1, len(filtered_order) + 1):  # Fixed: len(filtered_order) + 1
-                    if filtered_order[col - 1] == 'Filename':
-                        worksheet.set_column(col, col, 30, format2)
-                    else:
-                        worksheet.set_column(col, col, 20, format1)
-        # Open file browser at the directory containing the Excel file
+        # Open file browser at the directory containing the output file
         directory = dirname(abspath(target_path))
         if os.path.exists(directory):
             logging.debug(f"Opening file browser at: {directory}")
@@ -544,10 +1620,24 @@ def main():
         else:
             logging.debug(f"Directory not found: {directory}, opening Documents instead")
             subprocess.run(["explorer", os.path.expanduser("~/Documents")], shell=True)
-        success_msg = f"Excel file created successfully at {target_path}\n\n{len(raw_data)} files processed successfully."
-        mb.showinfo("Success", success_msg)
+        success_msg = f"{FORMATS[fmt]} created successfully at " + "\n".join(written) + f"\n\n{len(batch.file_results)} files processed successfully."
+        if invalid_files:
+            success_msg += f"\n{len(invalid_files)} files could not be read, see the Errors " + ("sheet." if fmt == 'xlsx' else "file.")
+        if batch.skipped_files:
+            success_msg += f"\n{len(batch.skipped_files)} files have no channel matching the selection and were skipped."
+        if batch.cancelled:
+            not_read = len(valid_files) - len(batch.file_results) - len(batch.invalid_files) - len(batch.skipped_files)
+            success_msg += f"\nCancelled: {not_read} files were not read."
+        mb.showinfo("Cancelled" if batch.cancelled else "Success", success_msg + "\n\n" + batch.stats.summary(slowest=0))
         logging.debug(success_msg)
         print(success_msg)
     
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Required for the process pool in the frozen PyInstaller executable
+    multiprocessing.freeze_support()
+    # Any command line arguments select the headless mode, none opens the GUI
+    if len(sys.argv) > 1:
+        sys.exit(cli())
+    # The GUI is profiled when META_DATA_READER_PROFILE names an output file
+    with profiled(os.getenv('META_DATA_READER_PROFILE')):
+        main()
\ No newline at end of file
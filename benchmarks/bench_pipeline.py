@@ -0,0 +1,146 @@
+"""Benchmark of the extraction pipeline, stage by stage, on synthetic batches.
+
+For every batch size a varied batch is written with ``synthetic.write_batch``
+and measured in fresh subprocesses, so peak RSS is per run:
+
+    discovery   discover() over the folder tree, including the magic-byte sniff
+    parse       header read and parse (read_file)
+    extract     retrieve_data
+    normalize   correct_units_and_values
+    export      building the result tables and writing them
+    end-to-end  export_metadata with the default workers and prefetch, no cache
+
+The first five run serially in one process so their times add up; end-to-end
+is the real parallel pipeline. ``--json`` appends the results to a file for
+comparing revisions.
+
+Run with ``python benchmarks/bench_pipeline.py [sizes ...] [--format csv] [--json results.json]``.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ['discovery', 'parse', 'extract', 'normalize', 'export']
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its largest child, in MiB (None if unknown)."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2 ** 20
+        except (ImportError, AttributeError):
+            return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale / 2 ** 20
+
+
+def run_stages(directory, fmt, out_dir):
+    import MetaDataReader as mdr
+    selection = mdr.build_selection(mdr.SELECTABLE_COLUMNS)
+    times = dict.fromkeys(STAGES, 0.0)
+    start = time.perf_counter()
+    files, rejected = mdr.discover([directory], recursive=True)
+    times['discovery'] = time.perf_counter() - start
+
+    file_results = {}
+    invalid_files = mdr.rejection_errors(rejected)
+    max_channels = 0
+    for d in files:
+        t0 = time.perf_counter()
+        try:
+            ScanB = mdr.read_file(d)
+        except Exception as e:
+            invalid_files[d] = mdr.FileError(d, 'parse', str(e))
+            continue
+        t1 = time.perf_counter()
+        Parameters, _, channel1_missing_cols = mdr.retrieve_data(ScanB, selection.plan)
+        t2 = time.perf_counter()
+        for dictt in Parameters:
+            mdr.correct_units_and_values(dictt, selection.plan)
+        t3 = time.perf_counter()
+        times['parse'] += t1 - t0
+        times['extract'] += t2 - t1
+        times['normalize'] += t3 - t2
+        file_results[d] = (len(ScanB.layers), Parameters)
+        max_channels = max(max_channels, len(ScanB.layers))
+
+    start = time.perf_counter()
+    channel_numbers = sorted({dictt['Channel'] for _, Parameters in file_results.values() for dictt in Parameters})
+    batch = mdr.BatchResult(file_results, invalid_files, max_channels, set(), channel_numbers=channel_numbers)
+    mdr.export_batch(batch, selection, os.path.join(out_dir, f'stages.{fmt}'), fmt)
+    times['export'] = time.perf_counter() - start
+    return {'files': len(files), 'failed': len(invalid_files), 'times': times}
+
+
+def run_end_to_end(directory, fmt, out_dir):
+    import MetaDataReader as mdr
+    start = time.perf_counter()
+    mdr.export_metadata([directory], os.path.join(out_dir, f'end_to_end.{fmt}'), fmt=fmt, use_cache=False, recursive=True)
+    return {'times': {'end-to-end': time.perf_counter() - start}}
+
+
+def child(mode, directory, fmt):
+    # Logs and the metadata cache of the measured run stay out of the user's profile
+    with tempfile.TemporaryDirectory() as out_dir:
+        os.environ['XDG_DATA_HOME'] = os.environ['LOCALAPPDATA'] = out_dir
+        result = (run_stages if mode == 'stages' else run_end_to_end)(directory, fmt, out_dir)
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def measure(mode, directory, fmt):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, directory, '--format', fmt],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the MetaDataReader pipeline on synthetic Bruker batches.")
+    parser.add_argument('sizes', nargs='*', type=int, default=[10, 1000, 50000])
+    parser.add_argument('--format', default='csv', help="Export format of the export stage (default: csv)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Append the results to this JSON lines file")
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'DIRECTORY'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return child(args.child[0], args.child[1], args.format)
+
+    from synthetic import write_batch
+    rows = []
+    print(f"{'files':>7}  {'stage':<11} {'seconds':>9} {'files/s':>10} {'peak RSS':>10}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            write_batch(directory, size, seed=args.seed)
+            stages = measure('stages', directory, args.format)
+            end_to_end = measure('end-to-end', directory, args.format)
+        for result in (stages, end_to_end):
+            for stage, seconds in result['times'].items():
+                rss = result['peak_rss_mb']
+                rows.append({'files': size, 'stage': stage, 'seconds': seconds, 'files_per_s': size / seconds if seconds else None,
+                             'peak_rss_mb': rss})
+                print(f"{size:>7}  {stage:<11} {seconds:>9.3f} {size / seconds if seconds else float('inf'):>10.0f}"
+                      f" {'n/a' if rss is None else f'{rss:.0f} MiB':>10}")
+        if stages['failed']:
+            print(f"         {stages['failed']} files failed to parse")
+    if args.json:
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'platform': platform.platform(),
+                  'cpus': os.cpu_count(), 'format': args.format, 'results': rows}
+        with open(args.json, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    main()
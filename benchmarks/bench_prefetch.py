@@ -0,0 +1,71 @@
+"""Benchmark: header prefetch on a simulated slow network share.
+
+A local directory stands in for the share; every open and every block read
+sleeps for ``latency`` seconds, like an SMB/NFS round trip. Extraction runs
+in-process (one worker and no per-file budget, which would need a worker
+process) so the injected latency applies to every read.
+
+Run with ``python benchmarks/bench_prefetch.py [n_files] [latency_ms]``.
+"""
+import builtins
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import discovery  # noqa: E402
+import spm_header  # noqa: E402
+from MetaDataReader import FileBudget, Prefetch, SELECTABLE_COLUMNS, build_selection, extract_files  # noqa: E402
+from synthetic import write_batch  # noqa: E402
+
+
+class SlowRaw(io.RawIOBase):
+    def __init__(self, path, latency):
+        self.raw = builtins.open(path, 'rb', buffering=0)
+        self.latency = latency
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        time.sleep(self.latency)
+        return self.raw.readinto(buffer)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+def slow_open(latency):
+    def _open(path, mode='r', *args, **kwargs):
+        if mode != 'rb':
+            return builtins.open(path, mode, *args, **kwargs)
+        time.sleep(latency)
+        return io.BufferedReader(SlowRaw(path, latency))
+    return _open
+
+
+def main(n_files=200, latency_ms=5.0):
+    latency = latency_ms / 1000
+    plan = build_selection(SELECTABLE_COLUMNS).plan
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_batch(directory, n_files, subdirectories=0, channels=2, interleave=False)
+        spm_header.open = discovery.open = slow_open(latency)
+        print(f"{n_files} files, {latency_ms} ms per open/read")
+        baseline = None
+        for prefetch in [Prefetch(0, 0), Prefetch(8, 4), Prefetch(32, 8), Prefetch(64, 16)]:
+            start = time.perf_counter()
+            results = extract_files(paths, plan, workers=1, prefetch=prefetch, budget=FileBudget(None, None))
+            elapsed = time.perf_counter() - start
+            assert all(error is None for _, _, error in results)
+            baseline = baseline or elapsed
+            print(f"depth {prefetch.depth:3d}, {prefetch.threads:2d} threads: {n_files / elapsed:8.1f} files/s"
+                  f"  ({baseline / elapsed:5.2f}x)")
+
+
+if __name__ == '__main__':
+    main(*(float(arg) if i else int(arg) for i, arg in enumerate(sys.argv[1:])))
@@ -0,0 +1,110 @@
+"""Benchmark of the start-up time, the time until the column picker appears.
+
+Every measurement runs in a fresh interpreter:
+
+    import      wall time of ``import MetaDataReader``
+    window      time until the column picker is drawn (needs a display)
+
+``python -X importtime`` breaks the import down by module; the slowest ones
+are listed, and any of the heavy modules that should only load after files
+are chosen (pandas, numpy, pySPM, xlsxwriter, pyarrow) is reported as a
+regression. ``--json`` appends the results to a file for comparing revisions.
+
+Run with ``python benchmarks/bench_startup.py [--runs 5] [--json results.json]``.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('pandas', 'numpy', 'pySPM', 'xlsxwriter', 'pyarrow')
+
+IMPORT_SCRIPT = f"""
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {ROOT!r})
+import MetaDataReader
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+# The idle callback runs once create_gui has built the window and starts waiting for input
+WINDOW_SCRIPT = f"""
+import sys, time, json, os
+start = time.perf_counter()
+sys.path.insert(0, {ROOT!r})
+import MetaDataReader
+import tkinter as tk
+try:
+    root = tk.Tk()
+except tk.TclError:
+    print(json.dumps({{'seconds': None}}))
+    sys.exit()
+def shown():
+    root.update()
+    print(json.dumps({{'seconds': time.perf_counter() - start}}), flush=True)
+    os._exit(0)
+root.after_idle(shown)
+MetaDataReader.create_gui(root, MetaDataReader.SELECTABLE_COLUMNS)
+"""
+
+
+def run(script, env, *flags):
+    result = subprocess.run([sys.executable, *flags, '-c', script], capture_output=True, text=True, env=env, timeout=120)
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def import_breakdown(stderr, top=8):
+    # Lines look like "import time:   self [us] | cumulative | imported package", nesting indents the name by two
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Direct imports of the top-level modules, e.g. MetaDataReader's own
+        if len(name) - len(name.lstrip()) == 3:
+            times.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(times, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the start-up of MetaDataReader until the first window.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', help="Append the results to this JSON lines file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Logs written at import time stay out of the user's profile
+        env = dict(os.environ, XDG_DATA_HOME=data_dir, LOCALAPPDATA=data_dir)
+        imports = [run(IMPORT_SCRIPT, env)[0] for _ in range(args.runs)]
+        windows = [run(WINDOW_SCRIPT, env)[0]['seconds'] for _ in range(args.runs)]
+        _, stderr = run(IMPORT_SCRIPT, env, '-X', 'importtime')
+
+    import_seconds = statistics.median(result['seconds'] for result in imports)
+    window_seconds = statistics.median(windows) if None not in windows else None
+    heavy = sorted({name for result in imports for name in result['heavy']})
+    print(f"import MetaDataReader: {import_seconds * 1000:8.1f} ms (median of {args.runs})")
+    print("first window:          " + (f"{window_seconds * 1000:8.1f} ms" if window_seconds is not None else "     n/a (no display)"))
+    print("slowest imports of MetaDataReader:")
+    for seconds, name in import_breakdown(stderr):
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+    if heavy:
+        print("REGRESSION: loaded at start-up: " + ", ".join(heavy))
+    if args.json:
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'platform': platform.platform(),
+                  'import_s': import_seconds, 'window_s': window_seconds, 'heavy_modules': heavy}
+        with open(args.json, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+    return 1 if heavy else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Micro-benchmark: value_parser.parse_number against the old character loop.
+
+Run with ``python benchmarks/bench_value_parser.py [repeat]``.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from value_parser import parse_number  # noqa: E402
+
+# Values as they appear in Nanoscope 9.x headers, after the "\Key: " prefix
+CORPUS = [
+    '5000 nm', '5000 nm', '-12.5 nm', '1.5e-05 nm', '90 °', '-1234.5', '55.1', '512', '256', '2:1',
+    '1.001 Hz', '10.01 µm/s', 'V 45.2 nm/V', 'V 2.1 nN/V',
+    'V [Sens. DeflSens] (0.0003051758 V/LSB) 0.5 V', 'V [Sens. DeflSens] (0.0003051758 V/LSB) 0 V',
+    'V 2.5', 'V 5', 'V 0.25', 'V 1.2',
+    'V [Sens. SampleBias] (0.006713867 V/LSB) -1.25 V', 'V [Sens. SampleBias] (0.006713867 V/LSB) 250 mV',
+    'V [Sens. Zsens] (0.006713867 V/LSB) 1.25 V', 'V [Sens. ZsensSens] (0.0004577637 V/LSB) 0.3419685 V',
+    'C [Sens. Zsens] 13.8 nm/V', '0.001968 V', '12.4991 nN/V',
+]
+
+
+def legacy_retreive_num_val(value):
+    for i in range(1, len(str(value)) + 1):
+        if not (str(value)[-i] == '.'):
+            try:
+                int(str(value)[-i])
+            except:
+                if str(value)[-i] == ':':
+                    i -= 1
+                break
+            else:
+                pass
+    return str(float(str(value)[-i:]))
+
+
+def legacy_parse(value):
+    # Numeric branch of the original correct_units_and_values()
+    try:
+        int(str(value)[-1])
+    except:
+        for i in range(1, len(str(value)) + 1):
+            try:
+                int(str(value)[-i])
+            except:
+                pass
+            else:
+                return legacy_retreive_num_val(str(value)[:-i + 1])
+        return value
+    return legacy_retreive_num_val(value)
+
+
+def main(repeat=200):
+    disagreements = [(v, legacy_parse(v), parse_number(v)) for v in CORPUS if float(legacy_parse(v)) != parse_number(v)]
+    for value, old, new in disagreements:
+        print(f"differs: {value!r}: legacy {old}, new {new}")
+    legacy = min(timeit.repeat(lambda: [legacy_parse(v) for v in CORPUS], number=repeat, repeat=5))
+    new = min(timeit.repeat(lambda: [parse_number(v) for v in CORPUS], number=repeat, repeat=5))
+    per_value = 1e6 / (repeat * len(CORPUS))
+    print(f"{len(CORPUS)} values x {repeat}")
+    print(f"legacy loop : {legacy * per_value:8.3f} us/value")
+    print(f"regex parser: {new * per_value:8.3f} us/value")
+    print(f"speedup     : {legacy / new:8.2f}x")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,139 @@
+"""Generator for synthetic Bruker / Nanoscope files.
+
+The files carry a Nanoscope 9.x style header with the keys ``MetaDataReader``
+extracts, so benchmarks do not depend on proprietary instrument data. Channel
+count, interleave mode, header size and image size can be set per file, and
+keys can be dropped to exercise the missing-value paths. Image data is
+allocated as a sparse hole by default: it is never read, and a 50k file batch
+then needs only a few hundred MB of real disk.
+
+``python benchmarks/synthetic.py DIRECTORY [n_files] [seed]`` writes a varied batch.
+"""
+import os
+import random
+import sys
+
+HEADER_SIZES = (40960, 81920)
+IMAGE_SIZES = (128, 256, 512, 1024)
+CHANNEL_NAMES = ('Height Sensor', 'Peak Force Error', 'DMTModulus', 'LogDMT', 'Adhesion', 'Deformation', 'Dissipation', 'Phase')
+
+# Scanner keys that may be dropped, by header key
+OPTIONAL_KEYS = (
+    'Tip Serial Number', 'X Offset', 'Y Offset', 'Rotate Ang.', 'Stage X', 'Stage Y', 'Tip Velocity', 'Units',
+    'Setpoint Units', 'Capture direction', '@Sens. DeflSens', '@Sens. ForceDeflSens', '@2:AFMSetDeflection',
+    '@2:AFMFbIgain', '@2:AFMFbPgain', '@2:SSRMSampleBias',
+)
+
+
+def header_lines(channels=2, interleave=False, header_size=40960, samples=512, lines=256, missing=(), latin1_units=False,
+                 rng=None):
+    rng = rng or random.Random(0)
+    deg, micro = ('\xb0', '\xb5') if latin1_units else ('deg', 'u')
+    image_bytes = samples * lines * 4
+    scanner = [
+        ('Scanner type', 'Dimension Icon'),
+        ('Stage X', f'{rng.uniform(-50000, 50000):.3f}'),
+        ('Stage Y', f'{rng.uniform(-50000, 50000):.3f}'),
+        ('Tip Serial Number', f'SCANASYST-AIR-{rng.randrange(1000):03d}'),
+    ]
+    scan = [
+        ('Scan Size', f'{rng.choice((500, 1000, 5000, 10000))} nm'),
+        ('Slow Axis Size', f'{rng.choice((500, 1000, 5000, 10000))} nm'),
+        ('X Offset', f'{rng.uniform(-1000, 1000):.4g} nm'),
+        ('Y Offset', f'{rng.uniform(-1000, 1000):.4g} nm'),
+        ('Rotate Ang.', f'{rng.choice((0, 45, 90))} {deg}'),
+        ('Samps/line', str(samples)),
+        ('Lines', str(lines)),
+        ('Aspect Ratio', f'{samples // lines}:1' if samples >= lines else f'1:{lines // samples}'),
+        ('Scan Rate', f'{rng.uniform(0.2, 2):.4g} Hz'),
+        ('Tip Velocity', f'{rng.uniform(1, 40):.4g} {micro}m/s'),
+        ('Units', 'Volts'),
+        ('Setpoint Units', 'V'),
+        ('Capture direction', rng.choice(('Up', 'Down'))),
+        ('Capture mode ', 'Continuous'),
+        ('@InterleaveList', 'Interleave mode: ' + ('Lift' if interleave else 'Disabled')),
+        ('@Sens. DeflSens', f'V {rng.uniform(20, 80):.4g} nm/V'),
+        ('@Sens. ForceDeflSens', f'V {rng.uniform(1, 5):.4g} nN/V'),
+        ('@2:AFMSetDeflection', f'V [Sens. DeflSens] (0.0003051758 V/LSB) {rng.uniform(0, 1):.4g} V'),
+        ('@2:AFMFbIgain', f'V {rng.uniform(0.5, 5):.3g}'),
+        ('@2:AFMFbPgain', f'V {rng.uniform(1, 10):.3g}'),
+        ('@2:SSRMSampleBias', f'V [Sens. SampleBias] (0.006713867 V/LSB) {rng.uniform(-2, 2):.4g} V'),
+    ]
+    if interleave:
+        scan += [
+            ('@3:AFMSetDeflection', f'V [Sens. DeflSens] (0.0003051758 V/LSB) {rng.uniform(0, 1):.4g} V'),
+            ('@3:AFMFbIgain', f'V {rng.uniform(0.5, 5):.3g}'),
+            ('@3:AFMFbPgain', f'V {rng.uniform(1, 10):.3g}'),
+            ('@3:SSRMSampleBias', f'V [Sens. SampleBias] (0.006713867 V/LSB) {rng.uniform(-2, 2):.4g} V'),
+        ]
+    out = ['\\*File list', '\\Version: 0x09400202', f'\\Data length: {header_size}', '\\*Equipment list',
+           '\\Description: Dimension Icon', '\\*Scanner list']
+    out += [f'\\{key}: {value}' for key, value in scanner if key not in missing]
+    out.append('\\*Ciao scan list')
+    out += [f'\\{key}: {value}' for key, value in scan if key not in missing]
+    for i in range(channels):
+        # With interleave, every second channel is an interleave (retrace) image
+        prefix = '@3' if interleave and i % 2 else '@2'
+        out += ['\\*Ciao image list', f'\\Data offset: {header_size + i * image_bytes}', f'\\Data length: {image_bytes}',
+                '\\Bytes/pixel: 4', f'\\Samps/line: {samples}', f'\\Number of lines: {lines}',
+                f'\\Aspect Ratio: {samples // lines}:1' if samples >= lines else f'\\Aspect Ratio: 1:{lines // samples}',
+                f'\\Line Direction: {rng.choice(("Trace", "Retrace"))}',
+                f'\\{prefix}:Image Data: S [{CHANNEL_NAMES[i % len(CHANNEL_NAMES)]}] "{CHANNEL_NAMES[i % len(CHANNEL_NAMES)]}"']
+    out.append('\\*File list end')
+    return out
+
+
+def write_file(path, channels=2, interleave=False, header_size=40960, samples=512, lines=256, missing=(),
+               latin1_units=False, sparse=True, rng=None):
+    """Write one synthetic file and return its size in bytes."""
+    header = ('\r\n'.join(header_lines(channels, interleave, header_size, samples, lines, missing, latin1_units, rng))
+              + '\r\n').encode('latin-1')
+    if len(header) > header_size:
+        raise ValueError(f"Header of {len(header)} bytes does not fit in {header_size}")
+    size = header_size + channels * samples * lines * 4
+    with open(path, 'wb') as f:
+        if sparse:
+            # Header padding and image data stay holes, they are zeros when read
+            f.write(header)
+            f.truncate(size)
+        else:
+            f.write(header.ljust(header_size, b'\x1a'))
+            f.write(os.urandom(size - header_size))
+    return size
+
+
+def random_file_options(rng, missing_rate=0.05):
+    samples = rng.choice(IMAGE_SIZES)
+    return dict(
+        channels=rng.randint(1, 8),
+        interleave=rng.random() < 0.3,
+        header_size=rng.choice(HEADER_SIZES),
+        samples=samples,
+        lines=rng.choice((samples, samples // 2)),
+        missing=tuple(key for key in OPTIONAL_KEYS if rng.random() < missing_rate),
+    )
+
+
+def write_batch(directory, n_files, seed=0, missing_rate=0.05, subdirectories=10, **options):
+    """Write ``n_files`` varied files below ``directory`` and return their paths.
+
+    Files are spread over ``subdirectories`` folders with .spm and .NNN names,
+    like a capture share; ``options`` override the per-file random choices.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n_files):
+        folder = os.path.join(directory, f'session_{i % subdirectories:02d}') if subdirectories else directory
+        os.makedirs(folder, exist_ok=True)
+        name = f'sample_{i:06d}.spm' if i % 5 == 0 else f'sample_{i:06d}.{i % 1000:03d}'
+        path = os.path.join(folder, name)
+        write_file(path, rng=rng, **{**random_file_options(rng, missing_rate), **options})
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    batch = write_batch(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 100, int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    print(f"Wrote {len(batch)} files to {sys.argv[1]}")
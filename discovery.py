@@ -0,0 +1,121 @@
+"""Fast discovery of Bruker files on disk.
+
+Directory trees are walked with ``os.scandir``, which gets the file type from
+the directory entry instead of a ``stat`` per file, and candidates are filtered
+by extension (``.spm`` / ``.NNN``) first. Every remaining file is sniffed from a
+small binary read: Bruker headers start with ``\\*File list``, anything else
+(ISO/TC 201 transfer files, exports that reuse the extensions) is rejected
+before any parsing.
+"""
+import logging
+import os
+import re
+
+BRUKER_MAGIC = b'\\*File list'
+ISO_MAGIC = b'ISO/TC 201'
+# Enough for the first header line, including the ISO/TC 201 banner
+SNIFF_BYTES = 128
+
+_SPM_EXT_RE = re.compile(r'\.(?:spm|\d{3})$', re.IGNORECASE)
+
+
+def is_spm_path(d):
+    return _SPM_EXT_RE.search(d) is not None
+
+
+def sniff(path):
+    """Return None if ``path`` starts like a Bruker header, else the reason it is rejected."""
+    with open(path, 'rb') as f:
+        return sniff_bytes(f.read(SNIFF_BYTES))
+
+
+def sniff_bytes(data):
+    """Same check as ``sniff`` on the leading bytes of a file that were already read."""
+    head = data[:SNIFF_BYTES]
+    if head.lstrip().startswith(BRUKER_MAGIC):
+        return None
+    if ISO_MAGIC in head:
+        return "Invalid file format (ISO/TC 201)"
+    return "Not a Bruker file (no \\*File list header)"
+
+
+def scan_tree(root, recursive=True):
+    """Yield the .spm/.NNN files in ``root`` (and its subdirectories), sorted per directory."""
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logging.debug(f"Cannot scan {directory}: {str(e)}")
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if recursive and entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif is_spm_path(entry.name) and entry.is_file():
+                    yield entry.path
+            except OSError:
+                continue
+        # Reversed so the stack visits subdirectories in name order
+        pending.extend(reversed(subdirs))
+
+
+def check_magic_bytes(paths, progress=None, cancel=None):
+    """Split ``paths`` into ``(files, rejected)`` by their leading bytes.
+
+    ``progress(done, total)`` is called after every file. Once the ``cancel``
+    event is set, the remaining files are left out of both.
+    """
+    files = []
+    rejected = {}
+    for i, d in enumerate(paths, 1):
+        if cancel is not None and cancel.is_set():
+            break
+        try:
+            reason = sniff(d)
+        except OSError as e:
+            reason = str(e)
+        if reason is None:
+            files.append(d)
+        else:
+            rejected[d] = reason
+        if progress is not None:
+            progress(i, len(paths))
+    return files, rejected
+
+
+def discover(paths, recursive=False, check_magic=True, progress=None, cancel=None):
+    """Expand files and directories into ``(files, rejected)``.
+
+    Directories contribute their .spm/.NNN files (the whole tree if ``recursive``),
+    files with other extensions are skipped silently there. Explicitly given
+    paths with another extension, and files failing the magic-byte check, end up
+    in ``rejected`` as ``{path: reason}``. ``progress(found)`` is called for every
+    file found, then ``progress(checked, total)`` while they are sniffed; when the
+    ``cancel`` event is set, the search stops and only the files checked so far
+    are returned.
+    """
+    files = []
+    rejected = {}
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = scan_tree(path, recursive)
+        elif is_spm_path(path):
+            candidates = [path]
+        else:
+            rejected[path] = "Unsupported extension"
+            continue
+        for d in candidates:
+            if cancel is not None and cancel.is_set():
+                break
+            files.append(d)
+            if progress is not None:
+                progress(len(files))
+    if check_magic:
+        files, sniffed = check_magic_bytes(files, progress, cancel)
+        rejected.update(sniffed)
+    logging.debug(f"Discovered {len(files)} files, rejected {len(rejected)}")
+    return files, rejected
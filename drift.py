@@ -0,0 +1,82 @@
+"""Drift report: which parameters change across a batch, and where.
+
+Works on one table with a row per file in scan order (the first channel table
+of an export), with whole-column pandas operations only:
+
+* the summary has one row per column: constant or varying, number of distinct
+  values, the batch mode, how many files differ from it, how many times the
+  value changes between consecutive scans and where it first changes;
+* the per-file table lists, for every scan, the columns that changed since the
+  previous scan and the columns that differ from the batch mode.
+
+The batch mode is the most common value among the files that have one. A
+column only has it if one value is more common than any other across two or
+more such files; on a tie, or with fewer files, the mode and the differences
+from it are left empty.
+
+Missing values count as a value of their own between scans, so a parameter that
+disappears is a change too. They are never the mode, but a file missing a value
+the batch mode has differs from it. pandas is imported on first use.
+"""
+
+# Bookkeeping columns that differ per file or per channel by design
+IGNORED_COLUMNS = ('Filename', 'Channel', 'Channel No.')
+
+
+def _same(values, other):
+    # Equal, or both missing; nullable (Int64) columns compare as NA where a side is missing
+    return (values == other).fillna(False).astype(bool) | (values.isna() & other.isna())
+
+
+def drift_tables(df, files=None, ignored=IGNORED_COLUMNS):
+    """Return ``(summary, by_file)`` DataFrames for ``df`` (one row per file, in scan order).
+
+    ``files`` labels the rows (default: the ``Filename`` column, else the row number).
+    """
+    import pandas as pd
+    values = df[[col for col in df.columns if col not in ignored]].reset_index(drop=True)
+    columns = pd.Index(values.columns)
+    if files is None:
+        files = df['Filename'] if 'Filename' in df.columns else pd.RangeIndex(1, len(df) + 1)
+    files = pd.Series(list(files), name='Filename')
+
+    changed = ~_same(values, values.shift())
+    if len(changed):
+        changed.iloc[0] = False
+    mode = pd.Series(index=columns, dtype=object)
+    has_mode = pd.Series(False, index=columns)
+    for col in columns:
+        counts = values[col].value_counts()
+        if counts.sum() > 1 and (len(counts) == 1 or counts.iloc[0] > counts.iloc[1]):
+            mode[col], has_mode[col] = counts.index[0], True
+    differs = ~_same(values, mode) & has_mode
+
+    distinct = values.nunique(dropna=False)
+    missing = values.isna().sum()
+    numeric = values.select_dtypes('number')
+    first_change = changed.idxmax().where(changed.any())
+    summary = pd.DataFrame({
+        'Column': columns,
+        'Status': ['missing' if missing[col] == len(values) else 'constant' if distinct[col] <= 1 else 'varies' for col in columns],
+        'Distinct values': distinct.values,
+        # Text, since the mode mixes numbers and text across columns
+        'Batch mode': [None if pd.isna(value) else str(value) for value in mode.reindex(columns)],
+        'Files differing from mode': differs.sum().where(has_mode).astype('Int64').values,
+        'Changes between scans': changed.sum().values,
+        'First change at': first_change.map(lambda i: files[int(i)] if pd.notna(i) else None).values,
+        'Min': numeric.min().reindex(columns).values,
+        'Max': numeric.max().reindex(columns).values,
+        'Missing': missing.values,
+    })
+    summary = summary.sort_values(['Changes between scans', 'Files differing from mode'], ascending=False, kind='stable')
+
+    # Boolean masks times "name, " strings concatenate the flagged column names per row
+    labels = columns + ', '
+    by_file = pd.DataFrame({
+        'Filename': files,
+        'Changed since previous scan': changed.dot(labels).str[:-2] if len(columns) else '',
+        'Number changed': changed.sum(axis=1),
+        'Differs from batch mode': differs.dot(labels).str[:-2] if len(columns) else '',
+        'Number differing': differs.sum(axis=1),
+    })
+    return summary.reset_index(drop=True), by_file
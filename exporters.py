@@ -0,0 +1,366 @@
+"""Output writers for the extracted metadata tables.
+
+Every writer takes a list of per-channel DataFrames (``ResultTable.to_frame``
+output) and either writes one file/sheet per channel or one long table with a
+``Channel`` column. Excel with the usual formatting stays the default; CSV,
+Parquet and Feather are plain tables for analysis. Parquet and Feather need the
+optional ``pyarrow`` package.
+
+``StreamingExporter`` writes the same layouts row by row while a batch is being
+read, for batches too large to hold in memory.
+
+pandas is only imported by the writers that need it. The streaming CSV and
+Excel sinks do without it, the Parquet/Feather sinks only use it once to get the
+same Arrow schema as the batch export.
+"""
+import csv
+import json
+import os
+
+from result_table import ResultTable, unit_header, with_unit_headers
+
+FORMATS = {
+    'xlsx': 'Excel workbook (.xlsx)',
+    'csv': 'CSV (.csv)',
+    'parquet': 'Parquet (.parquet)',
+    'feather': 'Feather / Arrow (.feather)',
+}
+LAYOUTS = {
+    'channels': 'One sheet / file per channel',
+    'long': 'Single table with a Channel column',
+}
+# Excel keeps its channel sheets, the analysis formats default to one long table
+DEFAULT_LAYOUTS = {'xlsx': 'channels', 'csv': 'long', 'parquet': 'long', 'feather': 'long'}
+
+
+def format_from_path(path, default='xlsx'):
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    if ext in ('arrow', 'ipc'):
+        return 'feather'
+    return ext if ext in FORMATS else default
+
+
+def channel_path(target_path, channel):
+    stem, ext = os.path.splitext(target_path)
+    return f"{stem}_Channel{channel}{ext}"
+
+
+def extra_path(target_path, name):
+    stem, ext = os.path.splitext(target_path)
+    return f"{stem}_{name.replace(' ', '_')}{ext}"
+
+
+def long_table(tables, file_channels=None, channel_numbers=None):
+    # file_channels[i] holds the channel numbers of file i; rows padding files without a channel are dropped
+    import pandas as pd
+    channel_numbers = channel_numbers or range(1, len(tables) + 1)
+    frames = []
+    for channel, df in zip(channel_numbers, tables):
+        frame = df.copy(deep=False)
+        frame.insert(0, 'Channel', channel)
+        if file_channels is not None:
+            frame = frame[[channel in channels for channels in file_channels]]
+        frames.append(frame)
+    result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    result.attrs['units'] = tables[0].attrs.get('units', {}) if tables else {}
+    return result
+
+
+def write_excel(tables, filtered_order, target_path, layout='channels', file_channels=None, extra_tables=None, channel_numbers=None):
+    import pandas as pd
+    if layout == 'long':
+        tables, sheet_names = [long_table(tables, file_channels, channel_numbers)], ['Metadata']
+        filtered_order = ['Channel'] + list(filtered_order)
+    else:
+        sheet_names = ['Channel' + str(n) for n in channel_numbers or range(1, len(tables) + 1)]
+    with pd.ExcelWriter(target_path) as writer:
+        for i in range(0, len(tables)):
+            df = with_unit_headers(tables[i])
+            df.to_excel(writer, sheet_name=sheet_names[i], index=True, na_rep='missing')
+            workbook = writer.book
+            worksheet = writer.sheets[sheet_names[i]]
+            format1 = workbook.add_format({'align': 'center'})
+            format1.set_font_size(8)
+            format2 = workbook.add_format({'num_format': '@', 'align': 'right'})
+            format2.set_font_size(14)
+            format_index = workbook.add_format({'align': 'center'})
+            format_index.set_font_size(8)
+            worksheet.set_column(0, 0, 5, format_index)
+            for col in range(1, len(filtered_order) + 1):  # Fixed: len(filtered_order) + 1
+                if filtered_order[col - 1] == 'Filename':
+                    worksheet.set_column(col, col, 30, format2)
+                else:
+                    worksheet.set_column(col, col, 20, format1)
+        for name, df in (extra_tables or {}).items():
+            df.to_excel(writer, sheet_name=name, index=False)
+            writer.sheets[name].set_column(0, len(df.columns) - 1, 22)
+    return [target_path]
+
+
+def _write_csv(df, path):
+    # Units go into the header so the file stays self-describing
+    with_unit_headers(df).to_csv(path, index=False)
+
+
+def _arrow_table(df):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("Parquet and Feather export require the 'pyarrow' package") from None
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'units'] = json.dumps(df.attrs.get('units', {})).encode('utf-8')
+    return table.replace_schema_metadata(metadata)
+
+
+def _write_parquet(df, path):
+    import pyarrow.parquet as pq
+    pq.write_table(_arrow_table(df), path)
+
+
+def _write_feather(df, path):
+    import pyarrow.feather as feather
+    feather.write_feather(_arrow_table(df), path)
+
+
+TABLE_WRITERS = {'csv': _write_csv, 'parquet': _write_parquet, 'feather': _write_feather}
+
+
+def export_tables(tables, filtered_order, target_path, fmt=None, layout=None, file_channels=None, extra_tables=None, channel_numbers=None):
+    """Write the channel tables to ``target_path`` and return the list of files written.
+
+    ``channel_numbers`` are the channel numbers of the tables (default 1, 2, ...),
+    they name the sheets / files and fill the ``Channel`` column of the long
+    layout. ``file_channels`` (the set of channel numbers of every file, in row
+    order) lets the long layout skip the empty rows that pad files without a
+    channel. ``extra_tables`` (name ->
+    DataFrame, e.g. a report) become extra sheets in Excel, else files named
+    after ``target_path`` plus the name.
+    """
+    fmt = fmt or format_from_path(target_path)
+    layout = layout or DEFAULT_LAYOUTS[fmt]
+    if fmt == 'xlsx':
+        return write_excel(tables, filtered_order, target_path, layout, file_channels, extra_tables, channel_numbers)
+    writer = TABLE_WRITERS[fmt]
+    if layout == 'long':
+        writer(long_table(tables, file_channels, channel_numbers), target_path)
+        written = [target_path]
+    else:
+        written = []
+        for channel, df in zip(channel_numbers or range(1, len(tables) + 1), tables):
+            writer(df, channel_path(target_path, channel))
+            written.append(channel_path(target_path, channel))
+    for name, df in (extra_tables or {}).items():
+        writer(df, extra_path(target_path, name))
+        written.append(extra_path(target_path, name))
+    return written
+
+
+class _CsvSink:
+    def __init__(self, path, columns, numeric_columns, units, append=False):
+        self.file = open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+        # Same line endings as pandas' to_csv, so appended and streamed rows match a batch export
+        self.writer = csv.writer(self.file, lineterminator=os.linesep)
+        if not append:
+            self.writer.writerow([unit_header(col, units.get(col, '')) for col in columns])
+
+    def write_rows(self, rows):
+        self.writer.writerows(['' if value is None else value for value in row] for row in rows)
+        # Flushed per file, so a killed run still leaves every finished row on disk
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _ArrowSink:
+    def __init__(self, path, schema, rows_per_group):
+        import pyarrow as pa
+        self.pa = pa
+        self.columns = schema.names
+        self.rows_per_group = rows_per_group
+        self.buffer = []
+        self.schema = schema
+        self.writer = self._open(path)
+
+    def write_rows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.rows_per_group:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            data = {col: [row[i] for row in self.buffer] for i, col in enumerate(self.columns)}
+            self.writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+class _ParquetSink(_ArrowSink):
+    def _open(self, path):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(path, self.schema)
+
+
+class _FeatherSink(_ArrowSink):
+    def _open(self, path):
+        return self.pa.ipc.new_file(path, self.schema)
+
+
+class _ExcelSink:
+    def __init__(self, workbook, sheet_name, columns):
+        self.worksheet = workbook.add_worksheet(sheet_name)
+        self.row = 1
+        format1 = workbook.add_format({'align': 'center'})
+        format1.set_font_size(8)
+        format2 = workbook.add_format({'num_format': '@', 'align': 'right'})
+        format2.set_font_size(14)
+        format_index = workbook.add_format({'align': 'center'})
+        format_index.set_font_size(8)
+        self.worksheet.set_column(0, 0, 5, format_index)
+        for col in range(1, len(columns) + 1):
+            if columns[col - 1] == 'Filename':
+                self.worksheet.set_column(col, col, 30, format2)
+            else:
+                self.worksheet.set_column(col, col, 20, format1)
+        self.header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+
+    def write_header(self, headers):
+        self.worksheet.write_row(0, 1, headers, self.header_format)
+
+    def write_rows(self, rows):
+        # constant_memory mode: rows go out strictly in order and are flushed once passed
+        for row in rows:
+            self.worksheet.write_row(self.row, 0, [self.row - 1] + ['missing' if value is None else value for value in row])
+            self.row += 1
+
+    def close(self):
+        pass
+
+
+class StreamingExporter:
+    """Write rows to the output as each file finishes instead of at the end.
+
+    Memory stays flat regardless of the batch size: Excel uses xlsxwriter's
+    ``constant_memory`` mode, Parquet/Feather append row groups of
+    ``rows_per_group`` rows and CSV is flushed after every file. ``close()``
+    must always be called (also on errors) to finalise the partial output.
+
+    Channel sheets / files are named after the ``'Channel'`` number in each row.
+    CSV output written earlier with the same columns can be extended in place:
+    ``existing_files`` lists the files already in it, in row order, and
+    ``existing_channels`` the channel numbers of its channel files.
+    """
+
+    def __init__(self, target_path, order, numeric_columns, units, fmt=None, layout=None, rows_per_group=1000,
+                 existing_files=None, existing_channels=(), integer_columns=()):
+        self.target_path = target_path
+        self.fmt = fmt or format_from_path(target_path)
+        self.layout = layout or DEFAULT_LAYOUTS[self.fmt]
+        self.order = list(order)
+        self.columns = (['Channel'] if self.layout == 'long' else []) + self.order
+        self.numeric_columns = set(numeric_columns)
+        self.integer_columns = set(integer_columns)
+        self.units = {col: unit for col, unit in units.items() if unit and col in self.columns}
+        self.rows_per_group = rows_per_group
+        self.schema = None
+        # Keyed by channel number, the long layout has a single 'Metadata' sink
+        self.sinks = {}
+        # Only needed to pad channel sheets/files that first appear partway through the batch
+        self.filenames = []
+        self.workbook = None
+        if self.fmt == 'xlsx':
+            import xlsxwriter
+            self.workbook = xlsxwriter.Workbook(target_path, {'constant_memory': True})
+        elif self.fmt not in TABLE_WRITERS:
+            raise ValueError(f"Unknown export format: {self.fmt}")
+        if existing_files is not None:
+            if self.fmt != 'csv':
+                raise ValueError(f"Only CSV output can be appended to, not {self.fmt}")
+            if self.layout == 'long':
+                self.sinks['Metadata'] = self._new_sink('Metadata', self.target_path, append=True)
+            else:
+                self.sinks = {n: self._new_sink('Channel' + str(n), channel_path(self.target_path, n), append=True)
+                              for n in existing_channels}
+                self.filenames = list(existing_files)
+
+    def _new_sink(self, name, path, append=False):
+        if self.fmt == 'xlsx':
+            sink = _ExcelSink(self.workbook, name, self.columns)
+            sink.write_header([unit_header(col, self.units.get(col, '')) for col in self.columns])
+            return sink
+        if self.fmt == 'csv':
+            return _CsvSink(path, self.columns, self.numeric_columns, self.units, append)
+        if self.schema is None:
+            self.schema = self._arrow_schema()
+        if self.fmt == 'parquet':
+            return _ParquetSink(path, self.schema, self.rows_per_group)
+        return _FeatherSink(path, self.schema, self.rows_per_group)
+
+    def _arrow_schema(self):
+        # Taken from a one-row frame built like the batch export's, so both write the same types and pandas
+        # metadata (e.g. nullable Int64); text gets a value for pandas to infer its string type from
+        table = ResultTable(self.order, 1, self.numeric_columns, self.units, self.integer_columns)
+        table.set_row(0, {col: '' for col in self.order if col not in self.numeric_columns and col not in self.integer_columns})
+        df = table.to_frame()
+        if self.layout == 'long':
+            df = long_table([df])
+        return _arrow_table(df.iloc[:0]).schema
+
+    def _channel_sink(self, channel):
+        if channel not in self.sinks:
+            sink = self._new_sink('Channel' + str(channel), channel_path(self.target_path, channel))
+            # Earlier files lack this channel: give them the same empty rows as the batch export
+            sink.write_rows([self._row(d, {}) for d in self.filenames])
+            self.sinks[channel] = sink
+        return self.sinks[channel]
+
+    def _row(self, d, Parameters):
+        # The long layout's Channel column comes straight from Parameters
+        row = [Parameters.get(col) for col in self.columns]
+        if 'Filename' in self.columns:
+            row[self.columns.index('Filename')] = d
+        return row
+
+    def add_file(self, d, Parameters):
+        if self.layout == 'long':
+            if not self.sinks:
+                self.sinks['Metadata'] = self._new_sink('Metadata', self.target_path)
+            self.sinks['Metadata'].write_rows([self._row(d, Parameters_j) for Parameters_j in Parameters])
+            return
+        channels = set()
+        for Parameters_j in Parameters:
+            self._channel_sink(Parameters_j['Channel']).write_rows([self._row(d, Parameters_j)])
+            channels.add(Parameters_j['Channel'])
+        for channel, sink in self.sinks.items():
+            if channel not in channels:
+                sink.write_rows([self._row(d, {})])
+        self.filenames.append(d)
+
+    def close(self, extra_tables=None):
+        """Finalise all outputs and return the list of files written.
+
+        ``extra_tables`` (name -> DataFrame) are added as in ``export_tables``.
+        """
+        for sink in self.sinks.values():
+            sink.close()
+        if self.workbook is not None:
+            for name, df in (extra_tables or {}).items():
+                worksheet = self.workbook.add_worksheet(name)
+                worksheet.set_column(0, len(df.columns) - 1, 22)
+                worksheet.write_row(0, 0, list(df.columns))
+                for i, row in enumerate(df.itertuples(index=False), 1):
+                    worksheet.write_row(i, 0, row)
+            self.workbook.close()
+            return [self.target_path]
+        if self.layout == 'long':
+            written = [self.target_path] if self.sinks else []
+        else:
+            written = [channel_path(self.target_path, n) for n in sorted(self.sinks)]
+        for name, df in (extra_tables or {}).items():
+            TABLE_WRITERS[self.fmt](df, extra_path(self.target_path, name))
+            written.append(extra_path(self.target_path, name))
+        return written
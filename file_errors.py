@@ -0,0 +1,21 @@
+"""Error records for files that could not be read.
+
+A ``FileError`` says which file failed, at which stage and why. The stages are
+the pipeline's own (discover, open, parse, extract) plus what can stop a worker
+process on a file: ``timeout``, ``memory`` and ``crash``. Records are plain
+tuples from a module of their own, so they pickle the same way from worker
+processes started by fork or spawn. ``str()`` of a record is the reason.
+"""
+from collections import namedtuple
+
+
+class FileError(namedtuple('FileError', ['file', 'stage', 'reason'])):
+    __slots__ = ()
+
+    def __str__(self):
+        return self.reason
+
+
+def rejection_errors(rejected):
+    """Turn the ``{path: reason}`` rejections of discovery into ``{path: FileError}``."""
+    return {d: FileError(d, 'discover', reason) for d, reason in rejected.items()}
@@ -0,0 +1,80 @@
+"""Timers and counters for the extraction pipeline.
+
+A ``RunStats`` collects the wall time per stage, the time per file and a few
+counters for one batch. Worker processes time their own stages and send the
+timings back with each result, the parent merges them, so stage totals are
+summed over all workers and can exceed the wall time. ``profiled`` optionally
+wraps a run in cProfile.
+"""
+import cProfile
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+STAGES = ('open', 'parse', 'extract', 'normalize', 'write')
+
+
+class RunStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.file_times = {}
+        self.counters = Counter()
+        # Prefetch threads report their reads concurrently
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_file(self, d, timings):
+        with self._lock:
+            for name, seconds in timings.items():
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self.file_times[d] = self.file_times.get(d, 0.0) + sum(timings.values())
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self, slowest=3):
+        elapsed = self.elapsed
+        files = self.counters['files']
+        lines = [f"{files} files ({self.counters['failed']} failed), {self.counters['channels']} channels in {elapsed:.2f} s"
+                 f" ({files / elapsed if elapsed else 0:.0f} files/s)",
+                 "Stage time: " + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.stages.items()),
+                 f"Missing values: {self.counters['missing values']}, cache hits: {self.counters['cache hits']},"
+                 f" cache misses: {self.counters['cache misses']}"]
+        if self.file_times and slowest:
+            worst = sorted(self.file_times.items(), key=lambda item: item[1], reverse=True)[:slowest]
+            lines.append("Slowest files: " + ", ".join(f"{d} ({seconds * 1000:.0f} ms)" for d, seconds in worst))
+        return "\n".join(lines)
+
+
+@contextmanager
+def profiled(path):
+    """Run the block under cProfile and dump the stats to ``path`` (no-op if ``path`` is empty)."""
+    if not path:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        logging.debug(f"Profile written to {path}")
@@ -0,0 +1,97 @@
+"""Manifest of the files already written to an incremental export.
+
+Stored as JSON next to the output. It records the export settings and, for
+every exported file, its size and mtime in the order the rows appear in the
+output, so a later update only has to read files that are new or changed.
+Files that could not be read, or had no channel matching the channel selection,
+are remembered too and are only retried once they change.
+"""
+import json
+import logging
+import os
+
+MANIFEST_VERSION = 2
+
+
+def file_signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class ExportManifest:
+    def __init__(self, path):
+        self.path = path
+        self.settings = None
+        self.files = {}
+        self.failed = {}
+        self.skipped = {}
+        self.channels = []
+        self.written = []
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            logging.debug(f"Ignoring manifest {path} with version {data.get('version')}")
+            return
+        self.settings = data['settings']
+        self.files = data['files']
+        self.failed = data['failed']
+        self.skipped = data.get('skipped', {})
+        self.channels = data['channels']
+        self.written = data['written']
+
+    def is_usable(self, settings):
+        # The output can only be extended if it was written with the same settings and still exists
+        return self.settings == settings and bool(self.written) and all(os.path.exists(path) for path in self.written)
+
+    def reset(self, settings):
+        self.settings = settings
+        self.files = {}
+        self.failed = {}
+        self.skipped = {}
+        self.channels = []
+        self.written = []
+
+    def changes(self, paths):
+        """Split ``paths`` into ``(new, changed, removed)`` relative to the manifest.
+
+        Failed and skipped files whose signature is unchanged count as neither new nor changed.
+        """
+        new, changed = [], []
+        seen = set()
+        for d in paths:
+            seen.add(d)
+            try:
+                signature = file_signature(d)
+            except OSError:
+                continue
+            if d in self.files:
+                if self.files[d] != signature:
+                    changed.append(d)
+            elif signature not in (self.failed.get(d), self.skipped.get(d)):
+                new.append(d)
+        removed = [d for d in self.files if d not in seen]
+        return new, changed, removed
+
+    def record(self, d, ok=True, skipped=False):
+        # Skipped files have no rows, so they stay out of ``files`` (the row order of the output)
+        try:
+            signature = file_signature(d)
+        except OSError:
+            return
+        target = self.skipped if skipped else self.files if ok else self.failed
+        for files in (self.files, self.failed, self.skipped):
+            if files is not target:
+                files.pop(d, None)
+        target[d] = signature
+
+    def save(self):
+        data = {'version': MANIFEST_VERSION, 'settings': self.settings, 'files': self.files, 'failed': self.failed, 'skipped': self.skipped,
+                'channels': self.channels, 'written': self.written}
+        # Written to a temporary file first so an interrupted save never leaves a broken manifest
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
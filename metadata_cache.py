@@ -0,0 +1,127 @@
+"""Persistent SQLite cache of parsed Bruker headers.
+
+Entries are keyed by absolute path and validated against file size and mtime
+(optionally a hash of the header bytes), so unchanged files are never re-read.
+The complete ``scanners`` / ``layers`` view is stored, which lets any column
+selection be rebuilt from the cache alone.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Number of leading bytes hashed when content hashing is enabled (covers the header)
+HASH_BYTES = 64 * 1024
+
+
+class CachedHeader:
+    """Header restored from the cache, with the same view as ``SpmHeader``."""
+
+    def __init__(self, path, scanners, layers):
+        self.path = path
+        self.scanners = scanners
+        self.layers = layers
+
+
+def _encode_sections(sections):
+    # bytes -> latin-1 text is lossless and keeps the payload plain JSON
+    return [[[key.decode('latin-1'), [value.decode('latin-1') for value in values]] for key, values in section.items()]
+            for section in sections]
+
+
+def _decode_sections(sections):
+    return [{key.encode('latin-1'): [value.encode('latin-1') for value in values] for key, values in section}
+            for section in sections]
+
+
+def _content_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(HASH_BYTES), digest_size=16).hexdigest()
+
+
+class HeaderCache:
+    def __init__(self, db_path, max_bytes=DEFAULT_MAX_BYTES, content_hash=False):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(db_path, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS headers ('
+            ' path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, content_hash TEXT,'
+            ' header TEXT, nbytes INTEGER, last_used REAL)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _signature(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns, _content_hash(path) if self.content_hash else None
+
+    def _is_current(self, path, columns):
+        # Returns the requested columns of the entry, or None if it is missing or stale
+        try:
+            size, mtime_ns, digest = self._signature(path)
+        except OSError:
+            return None
+        row = self._conn.execute(f'SELECT size, mtime_ns, content_hash{columns} FROM headers WHERE path = ?', (path,)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns or (digest is not None and row[2] != digest):
+            return None
+        return row[3:]
+
+    def is_fresh(self, path):
+        """Check whether ``path`` has a valid entry without loading it; stale or absent entries count as misses."""
+        if self._is_current(os.path.abspath(path), '') is None:
+            self.misses += 1
+            return False
+        return True
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        row = self._is_current(path, ', header')
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._conn.execute('UPDATE headers SET last_used = ? WHERE path = ?', (time.time(), path))
+        payload = json.loads(row[0])
+        return CachedHeader(path, _decode_sections(payload['scanners']), _decode_sections(payload['layers']))
+
+    def put(self, path, scanners, layers):
+        path = os.path.abspath(path)
+        try:
+            size, mtime_ns, digest = self._signature(path)
+        except OSError:
+            return
+        header = json.dumps({'scanners': _encode_sections(scanners), 'layers': _encode_sections(layers)})
+        self._conn.execute('INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (path, size, mtime_ns, digest, header, len(header), time.time()))
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        total = self._conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM headers').fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        stale = []
+        for path, nbytes in self._conn.execute('SELECT path, nbytes FROM headers ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            stale.append((path,))
+            total -= nbytes
+        self._conn.executemany('DELETE FROM headers WHERE path = ?', stale)
+        logging.debug(f"Metadata cache evicted {len(stale)} entries")
+        return len(stale)
+
+    def close(self):
+        self.evict()
+        self._conn.commit()
+        self._conn.close()
+        logging.debug(f"Metadata cache: {self.hits} hits, {self.misses} misses")
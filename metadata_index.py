@@ -0,0 +1,209 @@
+"""Queryable SQLite index of the extracted metadata of an archive.
+
+Every channel of every indexed file is one row of the ``channels`` table, with
+one typed column per metadata column (REAL for numeric columns, TEXT
+otherwise) and indexes on the columns scans are usually searched by. The
+``files`` table holds the path, size and mtime of every file, so re-indexing an
+archive only reads the files that are new or changed; files that could not be
+read are kept with their error and retried once they change.
+
+Filters are written like ``Scan Rate > 1 Hz``, ``Sample Bias between -2 and 0.5``,
+``Probe = SCANASYST-AIR-338`` or ``Channel Name ~ Height`` (contains) and are
+turned into parameterised SQL, so they never run as raw SQL.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+
+from manifest import file_signature
+from value_parser import numeric_unit, parse_number
+
+# Pending rows are committed every this many files, so an interrupted run keeps most of its work
+COMMIT_EVERY = 1000
+
+_FILTER_RE = re.compile(r'(?P<op>>=|<=|!=|==|=|>|<|~|between\b)\s*(?P<value>.*?)\s*$', re.IGNORECASE)
+_BETWEEN_RE = re.compile(r'(?P<low>.+?)\s+and\s+(?P<high>.+)$', re.IGNORECASE)
+SQL_OPERATORS = {'=': '=', '==': '=', '!=': '!=', '>': '>', '<': '<', '>=': '>=', '<=': '<='}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class MetadataIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.columns = []
+        self.numeric_columns = set()
+        self.integer_columns = set()
+        self.units = {}
+        self._pending = 0
+        self._conn = sqlite3.connect(db_path, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)')
+        row = self._conn.execute("SELECT value FROM settings WHERE name = 'columns'").fetchone()
+        if row is not None:
+            settings = json.loads(row[0])
+            self.columns = settings['columns']
+            self.numeric_columns = set(settings['numeric_columns'])
+            self.integer_columns = set(settings.get('integer_columns', []))
+            self.units = settings['units']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def configure(self, columns, numeric_columns, units, indexed_columns=(), integer_columns=()):
+        """Set the metadata columns; an index built with other columns or types is emptied first."""
+        numeric_columns = set(numeric_columns) & set(columns)
+        integer_columns = set(integer_columns) & numeric_columns
+        units = {col: unit for col, unit in units.items() if unit and col in columns}
+        if (columns, numeric_columns, integer_columns, units) == (self.columns, self.numeric_columns, self.integer_columns, self.units):
+            return
+        if self.columns:
+            logging.debug(f"Metadata index {self.db_path} has other columns, rebuilding it")
+        self._conn.execute('DROP TABLE IF EXISTS channels')
+        self._conn.execute('DROP TABLE IF EXISTS files')
+        self._conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER,'
+                           ' mtime_ns INTEGER, channels INTEGER, error TEXT)')
+        definitions = ''.join(f', {_quote(col)} {"INTEGER" if col in integer_columns else "REAL" if col in numeric_columns else "TEXT"}'
+                              for col in columns)
+        self._conn.execute(f'CREATE TABLE channels (file_id INTEGER NOT NULL, channel INTEGER NOT NULL{definitions})')
+        self._conn.execute('CREATE INDEX channels_file ON channels (file_id)')
+        for col in indexed_columns:
+            if col in columns:
+                self._conn.execute(f'CREATE INDEX {_quote("channels_" + col)} ON channels ({_quote(col)})')
+        self.columns, self.numeric_columns, self.integer_columns, self.units = columns, numeric_columns, integer_columns, units
+        settings = {'columns': columns, 'numeric_columns': sorted(numeric_columns), 'integer_columns': sorted(integer_columns), 'units': units}
+        self._conn.execute("INSERT OR REPLACE INTO settings VALUES ('columns', ?)", (json.dumps(settings),))
+        self._conn.commit()
+
+    def changes(self, paths):
+        """Return the ``paths`` that are not indexed or changed since, failed files only once they change."""
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self._conn.execute('SELECT path, size, mtime_ns FROM files')}
+        stale = []
+        for d in paths:
+            try:
+                signature = tuple(file_signature(os.path.abspath(d)))
+            except OSError:
+                continue
+            if known.get(os.path.abspath(d)) != signature:
+                stale.append(d)
+        return stale
+
+    def prune(self, roots, paths):
+        """Drop indexed files below ``roots`` (files or directories) that are not in ``paths``; return how many."""
+        keep = {os.path.abspath(d) for d in paths}
+        stale = []
+        for root in roots:
+            root = os.path.abspath(root)
+            prefix = os.path.join(root, '')
+            for file_id, path in self._conn.execute('SELECT id, path FROM files WHERE path = ? OR substr(path, 1, ?) = ?',
+                                                    (root, len(prefix), prefix)):
+                if path not in keep:
+                    stale.append((file_id,))
+        self._conn.executemany('DELETE FROM channels WHERE file_id = ?', stale)
+        self._conn.executemany('DELETE FROM files WHERE id = ?', stale)
+        return len(stale)
+
+    def _replace_file(self, d, channels, error):
+        d = os.path.abspath(d)
+        try:
+            size, mtime_ns = file_signature(d)
+        except OSError:
+            size = mtime_ns = None
+        row = self._conn.execute('SELECT id FROM files WHERE path = ?', (d,)).fetchone()
+        if row is not None:
+            self._conn.execute('DELETE FROM channels WHERE file_id = ?', row)
+            self._conn.execute('UPDATE files SET size = ?, mtime_ns = ?, channels = ?, error = ? WHERE id = ?',
+                               (size, mtime_ns, channels, error, row[0]))
+            return row[0]
+        return self._conn.execute('INSERT INTO files (path, size, mtime_ns, channels, error) VALUES (?, ?, ?, ?, ?)',
+                                  (d, size, mtime_ns, channels, error)).lastrowid
+
+    def add_file(self, d, Parameters):
+        """Index the per-channel parameters of ``d`` (same interface as ``StreamingExporter``)."""
+        file_id = self._replace_file(d, len(Parameters), None)
+        placeholders = ', '.join('?' * (len(self.columns) + 2))
+        self._conn.executemany(f'INSERT INTO channels VALUES ({placeholders})',
+                               [(file_id, dictt['Channel'], *(dictt.get(col) for col in self.columns)) for dictt in Parameters])
+        self._maybe_commit()
+
+    def add_failed(self, d, error):
+        self._replace_file(d, None, error)
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self._conn.commit()
+            self._pending = 0
+
+    def parse_filter(self, text):
+        """Turn one filter such as ``Scan Rate > 1 Hz`` into ``(sql, params)``."""
+        lowered = text.strip().lower()
+        names = ['Filename', 'Channel'] + self.columns
+        matches = [col for col in names if lowered.startswith(col.strip().lower())]
+        if not matches:
+            raise ValueError(f"Unknown column in filter: {text!r}")
+        # The longest name wins, e.g. 'Setpoint Units' over 'Setpoint'
+        col = max(matches, key=lambda name: len(name.strip()))
+        match = _FILTER_RE.match(text.strip()[len(col.strip()):].lstrip())
+        if match is None or not match.group('value'):
+            raise ValueError(f"Filter needs an operator (=, !=, <, <=, >, >=, ~, between) and a value: {text!r}")
+        op = match.group('op').lower()
+        target = 'f.path' if col == 'Filename' else 'c.channel' if col == 'Channel' else 'c.' + _quote(col)
+        if op == '~':
+            return f"{target} LIKE ? ESCAPE '\\'", ['%' + re.sub(r'([%_\\])', r'\\\1', match.group('value').strip('\'"')) + '%']
+        if op == 'between':
+            bounds = _BETWEEN_RE.match(match.group('value'))
+            if bounds is None:
+                raise ValueError(f"Expected 'between <low> and <high>': {text!r}")
+            return f'{target} BETWEEN ? AND ?', [self._value(col, bounds.group('low'), text), self._value(col, bounds.group('high'), text)]
+        return f'{target} {SQL_OPERATORS[op]} ?', [self._value(col, match.group('value'), text)]
+
+    def _value(self, col, value, text):
+        value = value.strip().strip('\'"')
+        if col != 'Channel' and col not in self.numeric_columns:
+            return value
+        unit = numeric_unit(value)
+        if unit is None:
+            raise ValueError(f"{col} is numeric, {value!r} is not a number: {text!r}")
+        if unit and unit != self.units.get(col, ''):
+            raise ValueError(f"{col} is stored in {self.units.get(col) or 'no unit'}, not {unit}: {text!r}")
+        return parse_number(value)
+
+    def query(self, filters=(), columns=None):
+        """Return ``(names, rows)`` of the indexed channels matching all ``filters``, by file and channel.
+
+        ``columns`` (default: all) are returned after the file path and channel number.
+        """
+        if not self.columns:
+            return ['Filename', 'Channel'] + list(columns or []), []
+        columns = self.columns if columns is None else columns
+        unknown = [col for col in columns if col not in self.columns]
+        if unknown:
+            raise ValueError(f"Not in the metadata index: {', '.join(unknown)}")
+        where, params = [], []
+        for text in filters:
+            sql, values = self.parse_filter(text)
+            where.append(sql)
+            params.extend(values)
+        select = ''.join(', c.' + _quote(col) for col in columns)
+        sql = (f'SELECT f.path, c.channel{select} FROM channels c JOIN files f ON f.id = c.file_id'
+               + (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY f.path, c.channel')
+        return ['Filename', 'Channel'] + list(columns), self._conn.execute(sql, params).fetchall()
+
+    def failed(self):
+        return dict(self._conn.execute('SELECT path, error FROM files WHERE error IS NOT NULL'))
+
+    def count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM files WHERE error IS NULL').fetchone()[0]
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
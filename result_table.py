@@ -0,0 +1,61 @@
+"""Columnar, typed store for extracted metadata.
+
+Each output table (one channel sheet, or the long table of the API) is backed by
+one preallocated array per column: float64 for numeric columns, with NaN for
+missing values, int64 plus a missing-value mask (pandas ``Int64``) for integer
+columns, and object arrays for text. Units are kept as column metadata
+instead of being glued onto every value. ``to_frame`` wraps the arrays in a
+DataFrame without copying them.
+
+numpy and pandas are imported on first use, so importing this module (and
+starting the GUI) stays fast.
+"""
+
+
+class ResultTable:
+    def __init__(self, columns, n_rows, numeric_columns=(), units=None, integer_columns=()):
+        import numpy as np
+        self.columns = list(columns)
+        self.n_rows = n_rows
+        self.units = {col: unit for col, unit in (units or {}).items() if unit and col in self.columns}
+        numeric_columns = set(numeric_columns)
+        # True where an integer column is missing, cleared as values are set
+        self.masks = {col: np.ones(n_rows, dtype=bool) for col in self.columns if col in integer_columns}
+        self.arrays = {
+            col: np.zeros(n_rows, dtype=np.int64) if col in self.masks
+            else np.full(n_rows, np.nan) if col in numeric_columns
+            else np.full(n_rows, None, dtype=object)
+            for col in self.columns
+        }
+
+    def set_row(self, i, Parameters):
+        # Columns that were not selected are ignored, None stays missing
+        for col, value in Parameters.items():
+            array = self.arrays.get(col)
+            if array is not None and value is not None:
+                array[i] = value
+                if col in self.masks:
+                    self.masks[col][i] = False
+
+    def set_value(self, i, col, value):
+        self.arrays[col][i] = value
+        if col in self.masks:
+            self.masks[col][i] = False
+
+    def to_frame(self):
+        import pandas as pd
+        arrays = {col: pd.arrays.IntegerArray(array, self.masks[col]) if col in self.masks else array
+                  for col, array in self.arrays.items()}
+        df = pd.DataFrame(arrays, columns=self.columns, copy=False)
+        df.attrs['units'] = dict(self.units)
+        return df
+
+
+def unit_header(col, unit):
+    return f"{col} [{unit}]" if unit else col
+
+
+def with_unit_headers(df):
+    """Return ``df`` with units appended to the column names, e.g. ``Scan Rate [Hz]``."""
+    units = df.attrs.get('units', {})
+    return df.rename(columns={col: unit_header(col, unit) for col, unit in units.items()})
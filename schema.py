@@ -0,0 +1,145 @@
+"""Index of the header keys found across a batch of Bruker files.
+
+Every key of the scanner list and of the image lists is recorded with the
+number of files it appears in, whether its values are numbers and their most
+common unit. Keys are named ``scanner:<key>`` or ``layer:<key>`` (e.g.
+``scanner:Scan Rate``, ``layer:Data offset``), which is also how they are
+requested as extra columns. The index is built from parsed headers only and
+cached per folder with the size and mtime of every file, so a repeated pass
+only reads the files that are new since the last one.
+"""
+import json
+import logging
+import os
+import sqlite3
+from collections import namedtuple
+
+from manifest import file_signature
+from value_parser import decode_value, numeric_unit
+
+HEADER_SOURCES = ('scanner', 'layer')
+
+# ``numeric`` is True when every value seen is a number, ``unit`` is the most common unit
+HeaderKey = namedtuple('HeaderKey', ['column', 'source', 'key', 'files', 'numeric', 'unit', 'example'])
+
+
+def header_column(source, key):
+    return f'{source}:{key}'
+
+
+def parse_header_column(name):
+    """Split a ``source:key`` column name into ``(source, key)``, or return None for other names."""
+    source, sep, key = name.partition(':')
+    if not sep or source not in HEADER_SOURCES or not key:
+        return None
+    return source, key
+
+
+def header_values(scanners, layers):
+    """Return ``{column: [text, ...]}`` with the first value of every key, one text per channel for layer keys."""
+    values = {}
+    for source, sections in (('scanner', scanners[:1]), ('layer', layers)):
+        for section in sections:
+            for key, value in section.items():
+                if not value or value[0] == b'':
+                    continue
+                # Keys stay latin-1 so column names map back to the exact header bytes
+                values.setdefault(header_column(source, key.decode('latin-1')), []).append(decode_value(value[0]))
+    return values
+
+
+class SchemaIndex:
+    def __init__(self, files=None, failed=None, keys=None):
+        # path -> [size, mtime_ns] of the files indexed / of those that could not be read
+        self.files = files or {}
+        self.failed = failed or {}
+        # column -> [files, numeric files, {unit: count}, example value]
+        self.keys = keys or {}
+
+    def add(self, path, scanners, layers, signature=None):
+        for column, texts in header_values(scanners, layers).items():
+            stats = self.keys.setdefault(column, [0, 0, {}, texts[0]])
+            stats[0] += 1
+            units = [numeric_unit(text) for text in texts]
+            if None not in units:
+                stats[1] += 1
+                for unit in units:
+                    stats[2][unit] = stats[2].get(unit, 0) + 1
+        self.files[path] = signature
+
+    def add_failed(self, path, signature=None):
+        self.failed[path] = signature
+
+    def update(self, other):
+        self.files.update(other.files)
+        self.failed.update(other.failed)
+        for column, (files, numeric, units, example) in other.keys.items():
+            stats = self.keys.setdefault(column, [0, 0, {}, example])
+            stats[0] += files
+            stats[1] += numeric
+            for unit, n in units.items():
+                stats[2][unit] = stats[2].get(unit, 0) + n
+
+    def get(self, column):
+        stats = self.keys.get(column)
+        if stats is None:
+            return None
+        files, numeric, units, example = stats
+        source, key = parse_header_column(column)
+        unit = max(units, key=units.get) if units else ''
+        return HeaderKey(column, source, key, files, numeric == files, unit, example)
+
+    def entries(self):
+        """All keys as ``HeaderKey``, the most frequent first."""
+        return sorted((self.get(column) for column in self.keys), key=lambda entry: (-entry.files, entry.column))
+
+
+class SchemaCache:
+    """Per-folder ``SchemaIndex`` entries in a SQLite database."""
+
+    def __init__(self, db_path):
+        self._conn = sqlite3.connect(db_path, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS schemas (folder TEXT PRIMARY KEY, payload TEXT)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load(self, folder, signatures):
+        """Return ``(index, missing)`` for ``folder``, whose files now have ``signatures``.
+
+        ``missing`` lists the files still to be added. A file that changed or is
+        gone cannot be taken out of the counts, so then the folder starts over.
+        """
+        row = self._conn.execute('SELECT payload FROM schemas WHERE folder = ?', (folder,)).fetchone()
+        if row is not None:
+            index = SchemaIndex(**json.loads(row[0]))
+            known = {**index.files, **index.failed}
+            if all(signatures.get(path) == signature for path, signature in known.items()):
+                return index, [path for path in signatures if path not in known]
+            logging.debug(f"Schema of {folder} is stale, indexing it again")
+        return SchemaIndex(), list(signatures)
+
+    def save(self, folder, index):
+        payload = json.dumps({'files': index.files, 'failed': index.failed, 'keys': index.keys})
+        self._conn.execute('INSERT OR REPLACE INTO schemas VALUES (?, ?)', (folder, payload))
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+def folder_signatures(paths):
+    """Group ``paths`` by absolute folder as ``{folder: {path: signature}}``, skipping files that vanished."""
+    folders = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        try:
+            signature = file_signature(path)
+        except OSError:
+            continue
+        folders.setdefault(os.path.dirname(path), {})[path] = signature
+    return folders
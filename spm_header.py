@@ -0,0 +1,219 @@
+"""Header-only reader for Bruker / Nanoscope .spm and .NNN files.
+
+Only the text header at the start of the file is read (up to ``\\*File list end``),
+image data is never touched. The parsed result exposes the same ``scanners`` /
+``layers`` view as ``pySPM.Bruker`` so it can be used as a drop-in replacement.
+
+``prefetch_headers`` reads the header bytes of upcoming files in a thread pool,
+so on network shares the I/O of the next files overlaps with parsing.
+"""
+import io
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+HEADER_END = b'*File list end'
+# Hard cap for files whose header does not declare its own length
+MAX_HEADER_BYTES = 1024 * 1024
+# Prefetch reads in large blocks, one round trip covers a typical 40-80 KiB header
+PREFETCH_CHUNK = 128 * 1024
+PREFETCH_DEPTH = 64
+PREFETCH_THREADS = 8
+# pySPM.Bruker reads the whole file, image data included; bigger files (or corrupt
+# ones claiming to be) are refused rather than loaded into memory
+PYSPM_MAX_FILE_BYTES = 1024 * 1024 * 1024
+
+
+class SpmHeaderError(Exception):
+    pass
+
+
+class SpmHeader:
+    """Bounded, streaming parse of a Bruker header into ``scanners`` and ``layers``.
+
+    Keys and values are kept as raw bytes with the same split as pySPM, so
+    ``header.scanners[0][b'Scan Rate'][0]`` returns the same value in both.
+    ``data`` holds bytes from ``read_header_bytes`` to parse instead of reading the file.
+    ``layers`` (0-based channel indexes) limits which image lists are parsed; the
+    others stay empty dicts, so channel numbers keep their position.
+    """
+
+    def __init__(self, path, max_bytes=MAX_HEADER_BYTES, data=None, layers=None):
+        self.path = path
+        self.scanners = []
+        self.layers = []
+        self.header_length = None
+        self.complete = False
+        self.truncated = False
+        # Stopped by ``max_bytes`` rather than the declared header length or a data offset
+        self.capped = False
+        # Some channels were left unparsed (``layers``), the header is partial and must not be cached
+        self.skipped_layers = False
+        self._parse(max_bytes, data, layers)
+
+    def _parse(self, max_bytes, data, layers):
+        limit = max_bytes
+        consumed = 0
+        mode = ''
+        with io.BytesIO(data) if data is not None else open(self.path, 'rb') as f:
+            while consumed < limit:
+                raw = f.readline(limit - consumed)
+                if not raw:
+                    self.truncated = True
+                    break
+                consumed += len(raw)
+                line = raw.rstrip().replace(b'\\', b'')
+                if line == HEADER_END:
+                    self.complete = True
+                    break
+                if line == b'*Ciao image list':
+                    self.layers.append({})
+                    mode = 'Image' if layers is None or len(self.layers) - 1 in layers else 'Skipped'
+                    self.skipped_layers |= mode == 'Skipped'
+                elif line == b'*Scanner list':
+                    self.scanners.append({})
+                    mode = 'Scanner'
+                elif line.startswith(b'*EC'):
+                    mode = 'EC'
+                elif mode == 'Skipped':
+                    # Lines of unselected channels are not split, only the data offset still bounds the read
+                    if line.startswith(b'Data offset: '):
+                        limit = min(limit, _to_int(line[13:], limit))
+                else:
+                    args = line.split(b': ')
+                    if len(args) < 2:
+                        continue
+                    if mode == 'Image':
+                        self.layers[-1][args[0]] = args[1:]
+                        # Image data starts at the first data offset, never read past it
+                        if args[0] == b'Data offset':
+                            limit = min(limit, _to_int(args[1], limit))
+                    elif mode == 'Scanner':
+                        self.scanners[-1][args[0]] = args[1:]
+                    elif args[0] == b'Data length' and self.header_length is None:
+                        # First "Data length" in the "\*File list" section is the header size
+                        self.header_length = _to_int(args[1], None)
+                        if self.header_length:
+                            limit = min(limit, self.header_length)
+        self.capped = not self.complete and not self.truncated and limit == max_bytes
+
+
+def _to_int(value, default):
+    try:
+        return int(value.strip())
+    except ValueError:
+        return default
+
+
+def read_header_bytes(path, max_bytes=MAX_HEADER_BYTES):
+    """Read the leading bytes of ``path`` up to the header end marker, EOF or ``max_bytes``.
+
+    Uses a few large reads instead of the line-by-line reads of the parser; the
+    result parses exactly like the file itself.
+    """
+    chunks = []
+    size = 0
+    with open(path, 'rb') as f:
+        while size < max_bytes:
+            chunk = f.read(min(PREFETCH_CHUNK, max_bytes - size))
+            if not chunk:
+                break
+            # The marker may straddle two chunks
+            tail = chunks[-1][-len(HEADER_END):] if chunks else b''
+            chunks.append(chunk)
+            size += len(chunk)
+            if HEADER_END in tail + chunk:
+                break
+    return b''.join(chunks)
+
+
+def _read_or_none(path, max_bytes, on_read):
+    start = time.perf_counter()
+    try:
+        return read_header_bytes(path, max_bytes)
+    except OSError:
+        # Left to the parser, which reads the file itself and reports the error
+        return None
+    finally:
+        if on_read is not None:
+            on_read(path, time.perf_counter() - start)
+
+
+def prefetch_headers(paths, depth=PREFETCH_DEPTH, threads=PREFETCH_THREADS, max_bytes=MAX_HEADER_BYTES, on_read=None):
+    """Yield ``(path, header_bytes)`` in input order, reading up to ``depth`` files ahead.
+
+    At most ``threads`` reads run at once. ``header_bytes`` is None if the read
+    failed, or for every file when ``depth`` or ``threads`` is 0 (no prefetch).
+    ``on_read(path, seconds)`` is called from the I/O thread after every read.
+    """
+    if depth <= 0 or threads <= 0:
+        for path in paths:
+            yield path, None
+        return
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        try:
+            for path in paths:
+                pending.append((path, executor.submit(_read_or_none, path, max_bytes, on_read)))
+                if len(pending) >= depth:
+                    path, future = pending.popleft()
+                    yield path, future.result()
+            while pending:
+                path, future = pending.popleft()
+                yield path, future.result()
+        finally:
+            # Consumer stopped early: do not wait for reads nobody will use
+            for _, future in pending:
+                future.cancel()
+
+
+def _has_header_end(path, max_bytes=PYSPM_MAX_FILE_BYTES):
+    # pySPM.Bruker reads lines until the end marker and never stops at EOF, so it must exist
+    tail = b''
+    size = 0
+    with open(path, 'rb') as f:
+        while size < max_bytes:
+            chunk = f.read(MAX_HEADER_BYTES)
+            if not chunk:
+                return False
+            if HEADER_END in tail + chunk:
+                return True
+            tail = chunk[-len(HEADER_END):]
+            size += len(chunk)
+    return False
+
+
+def load_scan(path, use_pyspm_fallback=True, data=None, layers=None):
+    """Return the scanners/layers view of ``path`` without reading image data.
+
+    Falls back to ``pySPM.Bruker`` (when installed) if the header is larger than
+    the bounded read allows and the end marker exists further on. Headers that
+    end early (truncated file, or no marker within the declared header length or
+    before the first data offset) raise ``SpmHeaderError``. ``data`` is the prefetched
+    output of ``read_header_bytes``, ``layers`` the channel indexes to parse (the
+    pySPM fallback always reads all of them).
+    """
+    header = SpmHeader(path, data=data, layers=layers)
+    if header.complete:
+        return header
+    if header.truncated:
+        raise SpmHeaderError(f"Header end marker not found before end of file: {path}")
+    if not header.capped:
+        raise SpmHeaderError(f"Header end marker not found within the declared header length: {path}")
+    if use_pyspm_fallback:
+        # Checked before the (slow) pySPM import
+        if os.path.getsize(path) > PYSPM_MAX_FILE_BYTES:
+            raise SpmHeaderError(f"Header end marker not found within {MAX_HEADER_BYTES} bytes and file too large"
+                                 f" for the pySPM fallback: {path}")
+        if not _has_header_end(path):
+            raise SpmHeaderError(f"Header end marker not found in the file: {path}")
+        try:
+            from pySPM import Bruker
+        except ImportError:
+            Bruker = None
+        if Bruker is not None:
+            logging.debug(f"Header of {path} exceeds bounded read, falling back to pySPM.Bruker")
+            return Bruker(path)
+    raise SpmHeaderError(f"Header end marker not found within {MAX_HEADER_BYTES} bytes: {path}")
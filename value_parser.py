@@ -0,0 +1,76 @@
+"""Parsing of Bruker header values into number, unit and scale.
+
+Bruker values come in a few shapes, all handled by one precompiled regex::
+
+    512
+    5000 nm
+    V 45.2 nm/V
+    V [Sens. Zsens] (0.006713867 V/LSB) 1.25 V
+    2:1
+
+The optional leading letter is the parameter type, ``[...]`` the soft scale
+name and ``(...)`` the hard scale. Ratios such as ``2:1`` evaluate to a float.
+
+Header bytes are text in Latin-1 (what Nanoscope writes for ``°`` and ``µ``)
+or, from some converters, UTF-8; ``decode_value`` takes either.
+"""
+import re
+from collections import namedtuple
+
+ParsedValue = namedtuple('ParsedValue', ['value', 'unit', 'scale', 'scale_unit', 'soft_scale'])
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+
+VALUE_RE = re.compile(
+    r'\s*(?:[A-Z]\s+(?=[\[(\d.+-]))?'
+    r'(?:\[(?P<soft_scale>[^\]]*)\]\s*)?'
+    r'(?:\((?P<scale>' + _NUMBER + r')\s*(?P<scale_unit>[^)]*)\)\s*)?'
+    r'(?P<value>' + _NUMBER + r')(?::(?P<denominator>' + _NUMBER + r'))?'
+    r'\s*(?P<unit>.*?)\s*$')
+
+# Anything else: the last number in the string, as the original parser did
+_LAST_NUMBER_RE = re.compile(r'.*?(' + _NUMBER + r')(?!.*\d)(?P<unit>.*?)\s*$')
+
+
+def decode_value(raw):
+    """Decode header bytes as UTF-8 if they are valid UTF-8, else as Latin-1 (never fails)."""
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('latin-1')
+
+
+def parse_value(text):
+    """Split a header value into a ``ParsedValue``, or return None if it holds no number."""
+    match = VALUE_RE.fullmatch(text)
+    if match is None:
+        match = _LAST_NUMBER_RE.match(text)
+        if match is None:
+            return None
+        return ParsedValue(float(match.group(1)), match.group('unit').strip(), None, '', None)
+    value = float(match.group('value'))
+    if match.group('denominator') is not None:
+        denominator = float(match.group('denominator'))
+        value = value / denominator if denominator else float('nan')
+    scale = match.group('scale')
+    return ParsedValue(value, match.group('unit'), float(scale) if scale is not None else None,
+                       match.group('scale_unit').strip() if scale is not None else '', match.group('soft_scale'))
+
+
+def parse_number(text):
+    """Return the numeric part of a header value as a float, or None."""
+    parsed = parse_value(text)
+    return parsed.value if parsed is not None else None
+
+
+def numeric_unit(text):
+    """Return the unit of a value that is a number (``''`` if it has none), or None for text.
+
+    Stricter than ``parse_value``: the whole value has to be a number with
+    optional type letter, scales and unit, so e.g. serial numbers, dates and
+    hex versions count as text.
+    """
+    match = VALUE_RE.fullmatch(text)
+    if match is None or any(c.isdigit() for c in match.group('unit')):
+        return None
+    return match.group('unit')